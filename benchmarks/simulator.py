@@ -0,0 +1,350 @@
+"""Fake Discord gateway which simulates players guessing against the REST rate limits.
+
+Every processed guess costs the API calls the bot makes for it (deleting the guess message and
+editing the game post). Discord limits these per channel and every thread is a channel of its
+own, so spreading games across threads raises the aggregate guess throughput. Guessing with
+the menus of the game post (GUESS_COMPONENTS) only costs the response to the interaction,
+which isn't limited per channel.
+
+Menu guesses are processed by the handler of the bot (`ComponentGuesses`) with fake
+interactions, so rejected guesses (author, cooldown, stale post, shed) and the API calls of the
+responses and followups are measured as the bot makes them. The authors of the games play along.
+
+    python3 benchmarks/simulator.py [threads] [players per game] [seconds]
+"""
+
+import asyncio
+import atexit
+import os
+import random
+import re
+import shutil
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "hangmanbot"))
+os.environ.setdefault("TOKEN", "benchmark")
+# Never touch the data of a bot running on this machine
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="hangmanbot-sim-")
+atexit.register(shutil.rmtree, os.environ["DATA_DIR"], ignore_errors=True)
+
+# pylint: disable=wrong-import-position
+from components import ComponentGuesses, GuessView
+from cooldowns import Cooldowns, CooldownType
+from guesses import active_cooldown, apply_guess
+from queues import Command, CommandQueues
+from settings import COMMAND_QUEUE_DEPTH
+from states import States, Running, game_key
+
+# Discord allows about 5 message edits/deletes per 5 seconds per channel. The window is scaled
+# down so simulations finish quickly, which doesn't change the relative throughput.
+RATE_LIMIT = 5
+RATE_LIMIT_WINDOW = 0.05
+# Round trip of an API call (about 100ms), scaled like the rate limit window
+API_LATENCY = 0.1 * RATE_LIMIT_WINDOW / 5
+# Players guess about once per second, scaled like the rate limit window
+THINK_TIME = 1 * RATE_LIMIT_WINDOW / 5
+# Interactions have to be answered within 3 seconds, scaled like the rate limit window
+RESPONSE_DEADLINE = 3 * RATE_LIMIT_WINDOW / 5
+PHRASES = ["hangman", "discord bot", "rate limit", "throughput", "asyncio event loop"]
+
+
+class RateLimit:
+    """Per channel bucket allowing `RATE_LIMIT` API calls per `RATE_LIMIT_WINDOW` seconds"""
+
+    def __init__(self):
+        self.__calls = []
+        self.__lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Waits until another API call is allowed"""
+        async with self.__lock:
+            while True:
+                now = time.monotonic()
+                self.__calls = [call for call in self.__calls if now - call < RATE_LIMIT_WINDOW]
+                if len(self.__calls) < RATE_LIMIT:
+                    break
+                await asyncio.sleep(RATE_LIMIT_WINDOW - (now - self.__calls[0]))
+            self.__calls.append(now)
+
+
+class FakeChannel:
+    """Channel or thread (if `parent_id` is set) with its own rate limit bucket"""
+
+    def __init__(self, channel_id: int, parent_id: int = None):
+        self.id = channel_id  # pylint: disable=invalid-name
+        if parent_id is not None:
+            self.parent_id = parent_id
+        self.rate_limit = RateLimit()
+        self.api_calls = 0
+
+    async def call(self):
+        """Simulates a rate limited API call in this channel"""
+        await self.rate_limit.acquire()
+        await asyncio.sleep(API_LATENCY)
+        self.api_calls += 1
+
+    async def send(self, _content: str = None, **_kwargs):
+        """Posts a message"""
+        await self.call()
+
+
+class FakeMember:
+    """Member guessing in a game"""
+
+    def __init__(self, member_id: int):
+        self.id = member_id  # pylint: disable=invalid-name
+        self.mention = f"<@{member_id}>"
+
+
+class FakeMessage:
+    """Game post an interaction was made on"""
+
+    def __init__(self, message_id: int):
+        self.id = message_id  # pylint: disable=invalid-name
+
+
+def outcome(content: str, ephemeral: bool) -> str:
+    """Returns how a message answered a guess. Rejections are told apart by their text, without
+    the remaining cooldown."""
+    return f"{'ephemeral' if ephemeral else 'message'} '{re.sub(r'[0-9]+', 'N', content)}'"
+
+
+class FakeResponse:
+    """Response of an interaction, which can only be sent once like `InteractionResponse`"""
+
+    def __init__(self, interaction: "FakeInteraction"):
+        self.__interaction = interaction
+        self.kind = None
+        self.delay = None
+
+    async def __respond(self, kind: str):
+        if self.kind:
+            raise RuntimeError("This interaction has already been responded to before")
+        self.kind = kind
+        await self.__interaction.call()
+        self.delay = time.monotonic() - self.__interaction.created
+
+    async def send_message(self, content: str = None, ephemeral: bool = False, **_kwargs):
+        """Answers with a new message, `ephemeral` ones are only shown to the user"""
+        await self.__respond("message")
+        self.__interaction.finish(outcome(content, ephemeral))
+
+    async def edit_message(self, content: str = None, **_kwargs):
+        """Answers by editing the message the component belongs to"""
+        await self.__respond("edit")
+        self.__interaction.finish("edit")
+
+    async def defer(self, **_kwargs):
+        """Answers without changes, the message can be edited later"""
+        await self.__respond("defer")
+
+
+class FakeFollowup:
+    """Webhook of an interaction to send further messages"""
+
+    def __init__(self, interaction: "FakeInteraction"):
+        self.__interaction = interaction
+
+    async def send(self, content: str = None, ephemeral: bool = False, **_kwargs):
+        """Posts a message, which isn't limited per channel"""
+        if not self.__interaction.response.kind:
+            raise RuntimeError("The interaction has to be responded to before followups")
+        await self.__interaction.call()
+        if ephemeral:
+            self.__interaction.finish(outcome(content, ephemeral))
+
+
+class FakeInteraction:
+    """Selection of a letter in the menus of a game post"""
+
+    def __init__(self, channel: FakeChannel, user: FakeMember, post_id: int):
+        self.channel = channel
+        self.user = user
+        self.message = FakeMessage(post_id)
+        self.guild_id = 1
+        self.created = time.monotonic()
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.outcome = None
+        self.done = asyncio.Event()
+
+    async def call(self):
+        """Simulates an API call with the token of the interaction, which isn't limited per
+        channel"""
+        await asyncio.sleep(API_LATENCY)
+        self.channel.api_calls += 1
+
+    def finish(self, kind: str):
+        """Records how the guess was answered in the end"""
+        if self.outcome is None:
+            self.outcome = kind
+            self.done.set()
+
+    async def edit_original_response(self, content: str = None, **_kwargs):
+        """Edits the message of a deferred interaction"""
+        if self.response.kind != "defer":
+            raise RuntimeError("Only deferred interactions can be edited")
+        await self.call()
+        self.finish("edit")
+
+
+class Gateway:
+    """Hosts the games of the simulation and counts processed guesses and responses"""
+
+    def __init__(self, components: bool = False):
+        self.states = States({})
+        self.cooldowns = Cooldowns()
+        self.queues = CommandQueues(COMMAND_QUEUE_DEPTH)
+        self.handler = ComponentGuesses(self.states, self.cooldowns, self.queues,
+                                        accepting=lambda: True)
+        self.components = components
+        self.guesses = 0
+        self.responses = {}
+        self.interactions = []
+        self.__post_ids = 0
+
+    def start(self, channel: FakeChannel, author: FakeMember):
+        """Starts a new game in the channel"""
+        self.__post_ids += 1
+        self.states[game_key(channel)] = Running(random.choice(PHRASES), author_id=author.id,
+                                                 author_name="simulator",
+                                                 post_id=self.__post_ids)
+
+    def __count(self, kind: str):
+        self.responses[kind] = self.responses.get(kind, 0) + 1
+
+    async def command_guess(self, channel: FakeChannel, member: FakeMember):
+        """Processes a guess like the `!g` command: delete the message, queue the guess and
+        edit the post. Rejected guesses are answered with a message."""
+        key = game_key(channel)
+        old_state = self.states[key]
+        await channel.call()
+        if old_state.author_id == member.id:
+            self.__count("message")
+            await channel.call()
+            return
+        guess = random.choice(string.ascii_lowercase)
+        done = asyncio.get_running_loop().create_future()
+
+        async def process():
+            if active_cooldown(self.cooldowns, (CooldownType.GUESS, member.id, key)):
+                self.__count("message")
+                await channel.call()
+                return
+            new_state = apply_guess(self.states, self.cooldowns, key, old_state, guess,
+                                    member, 1)
+            self.guesses += 1
+            self.__count("edit")
+            await channel.call()
+            if not isinstance(new_state, Running):
+                await channel.send(f"{new_state}")
+
+        async def handler():
+            try:
+                await process()
+            finally:
+                done.set_result(None)
+
+        async def shed(_reason):
+            done.set_result(None)
+
+        reason = self.queues.submit(key, Command(
+            name=guess, handler=handler, on_shed=shed,
+            valid=lambda: key in self.states and self.states[key] is old_state))
+        if reason:
+            self.__count(f"shed {reason.value}")
+        else:
+            await done
+
+    async def component_guess(self, channel: FakeChannel, member: FakeMember, post_id: int):
+        """Selects a letter offered by the menus of the post with the real menu handler and
+        waits until the interaction was answered"""
+        state = self.states[game_key(channel)]
+        view = GuessView.render(state.guessed)
+        letter = random.choice([option.value for menu in view.children
+                                for option in menu.options])
+        interaction = FakeInteraction(channel, member, post_id)
+        self.interactions.append(interaction)
+        await self.handler.on_guess(interaction, letter)
+        try:
+            await asyncio.wait_for(interaction.done.wait(), RESPONSE_DEADLINE * 10)
+        except asyncio.TimeoutError:
+            self.__count("unanswered")
+            return
+        self.__count(interaction.outcome)
+        if interaction.outcome == "edit":
+            self.guesses += 1
+
+    async def player(self, channel: FakeChannel, member: FakeMember, author: FakeMember,
+                     deadline: float):
+        """Guesses in the channel until the simulation is over. With components the player
+        keeps guessing on the post it saw last, which is stale once its game is over."""
+        key = game_key(channel)
+        seen_post = None
+        while time.monotonic() < deadline:
+            if key not in self.states:
+                self.start(channel, author)
+            if self.components:
+                post_id = seen_post or self.states[key].post_id
+                await self.component_guess(channel, member, post_id)
+                seen_post = self.states[key].post_id if key in self.states else post_id
+            else:
+                await self.command_guess(channel, member)
+            await asyncio.sleep(random.uniform(0, 2 * THINK_TIME))
+
+
+async def simulate(threads: int, players: int, seconds: float,
+                   components: bool = False) -> (float, float, Gateway):
+    """Returns the guesses per second, API calls per guess and the gateway with one game in
+    the channel and `threads` additional games in threads of the channel"""
+    gateway = Gateway(components)
+    channels = [FakeChannel(1)]
+    channels += [FakeChannel(100 + thread, parent_id=1) for thread in range(threads)]
+    members = {channel.id: [FakeMember(1000 * index + player + 1) for player in range(players)]
+               for index, channel in enumerate(channels)}
+    for channel in channels:
+        # The first player of every channel starts its games
+        gateway.start(channel, members[channel.id][0])
+
+    deadline = time.monotonic() + seconds
+    await asyncio.gather(*[
+        gateway.player(channel, member, members[channel.id][0], deadline)
+        for channel in channels
+        for member in members[channel.id]
+    ])
+    await gateway.queues.drain(seconds)
+    calls = sum(channel.api_calls for channel in channels)
+    return gateway.guesses / seconds, calls / max(gateway.guesses, 1), gateway
+
+
+def main(threads: int, players: int, seconds: float):
+    """Compares a single game per channel with additional games in threads and guessing with
+    commands against guessing with components"""
+    total = players * (threads + 1)
+    single, _, _ = asyncio.run(simulate(0, total, seconds))
+    for label, args in ((f"1 game with {total} players", (0, total)),
+                        (f"{threads + 1} games with {players} players each", (threads, players)),
+                        # A single guesser besides the author is always on cooldown
+                        ("1 game with 2 players", (0, 2))):
+        for mode, components in (("commands", False), ("components", True)):
+            throughput, calls, gateway = asyncio.run(simulate(*args, seconds,
+                                                              components=components))
+            print(f"{label}, {mode}: {throughput:.1f} guesses/s ({throughput / single:.1f}x), "
+                  f"{calls:.1f} API calls per guess")
+            for kind, count in sorted(gateway.responses.items()):
+                print(f"    {count:6d} {kind}")
+            if components:
+                delays = [interaction.response.delay for interaction in gateway.interactions
+                          if interaction.response.kind]
+                late = sum(delay > RESPONSE_DEADLINE for delay in delays)
+                print(f"    slowest response {max(delays) / RESPONSE_DEADLINE:.0%} of the "
+                      f"deadline, {late} of {len(delays)} interactions answered too late")
+
+
+if __name__ == '__main__':
+    ARGS = [float(arg) for arg in sys.argv[1:]]
+    main(int(ARGS[0]) if ARGS else 4, int(ARGS[1]) if len(ARGS) > 1 else 5,
+         ARGS[2] if len(ARGS) > 2 else 2.0)
@@ -0,0 +1,264 @@
+"""Performance regression suite for the game and storage paths.
+
+Measures every metric, compares it with the stored baseline and exits with 1 if a metric got
+worse than the baseline by more than the threshold plus the spread of its measurements and by
+more than the noise floor of its unit. Baselines depend on the machine, so they aren't
+committed: record one (--update) on the machine the suite runs on before comparing changes.
+Without a baseline the metrics are only printed.
+
+    python3 benchmarks/suite.py [--update] [--threshold 0.25] [--sizes 1000,10000,100000]
+"""
+
+import argparse
+import atexit
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "hangmanbot"))
+os.environ.setdefault("TOKEN", "benchmark")
+# Never touch the data of a bot running on this machine
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="hangmanbot-bench-")
+atexit.register(shutil.rmtree, os.environ["DATA_DIR"], ignore_errors=True)
+
+# pylint: disable=wrong-import-position
+from cooldowns import Cooldowns, CooldownType
+from states import States, StatesEncoder, Running
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+SHORT_PHRASE = "hangman"
+LONG_PHRASE = "the quick brown fox jumps over the lazy dog while the hangman bot keeps score " * 4
+REPEAT = 7
+# Like timeit.autorange, a run is repeated until it took this long, so short runs aren't
+# dominated by timer resolution and scheduling noise
+MIN_RUNTIME = 0.2
+# Absolute changes below these (by unit suffix of the metric) are noise, not regressions
+NOISE_FLOORS = {'_us': 0.5, '_ms': 1.0, '_mb_s': 2.0, '_kib': 0.1}
+
+
+class Member:
+    """Guessing member, only provides what `Running.guess` uses of a `discord.Member`"""
+
+    def __init__(self, member_id: int):
+        self.id = member_id  # pylint: disable=invalid-name
+        self.mention = f"<@{member_id}>"
+
+
+# A metric and the relative spread of its measurements ((slowest - fastest) / median)
+Sample = (float, float)
+
+
+def median_of(func, number: int, repeat: int = REPEAT, setup=None, scale: float = 1) -> Sample:
+    """Measures `func`, which makes `number` calls, `repeat` times. Returns the median in
+    seconds per call times `scale` and the spread of the measurements. Every measurement runs
+    `func` until `MIN_RUNTIME` passed. `setup` is called before every run of `func` (and not
+    measured) and its result is passed to `func`."""
+    times = []
+    for _ in range(repeat):
+        runs, elapsed = 0, 0.0
+        while elapsed < MIN_RUNTIME:
+            arg = setup() if setup else None
+            # Like timeit, collections triggered by earlier allocations shouldn't be measured
+            gc.collect()
+            gc.disable()
+            try:
+                start = time.perf_counter()
+                func(arg)
+                elapsed += time.perf_counter() - start
+            finally:
+                gc.enable()
+            runs += 1
+        times.append(elapsed / runs / number)
+    times.sort()
+    median = times[len(times) // 2]
+    return median * scale, (times[-1] - times[0]) / median
+
+
+def bench_guess(phrase: str) -> Sample:
+    """Microseconds per correct guess of a letter"""
+    number = 10_000
+    member = Member(1)
+    letter = phrase.strip()[0]
+
+    def setup():
+        return [Running(phrase, author_id=0, author_name="bench") for _ in range(number)]
+
+    def run(games):
+        for game in games:
+            game.guess(letter, member)
+    return median_of(run, number, setup=setup, scale=1e6)
+
+
+def bench_render(phrase: str) -> Sample:
+    """Microseconds to render the post of a game"""
+    number = 10_000
+    game = Running(phrase, author_id=0, author_name="bench")
+    for letter in "etaoin":
+        game.guess(letter, Member(1))
+
+    def run(_):
+        for _ in range(number):
+            str(game)
+    return median_of(run, number, scale=1e6)
+
+
+def games(count: int) -> States:
+    """Returns states with `count` running games which were guessed a few times"""
+    states = {}
+    for channel in range(count):
+        game = Running(LONG_PHRASE[:40], author_id=0, author_name="bench", post_id=channel)
+        for letter in "etao":
+            game.guess(letter, Member(channel))
+        states[(channel, 0)] = game
+    return States(states)
+
+
+def bench_states(count: int) -> (Sample, Sample):
+    """Milliseconds to persist `count` games after a change and to load them"""
+    states = games(count)
+    repeat = REPEAT if count < 100_000 else 3
+    game = states[(0, 0)]
+
+    def save(_):
+        # Saves like every change of a game does, without waiting for the disk like flush
+        states[(0, 0)] = game
+    return (median_of(save, 1, repeat=repeat, scale=1e3),
+            median_of(lambda _: States.load(), 1, repeat=repeat, scale=1e3))
+
+
+def bench_encode() -> Sample:
+    """Megabytes of states json encoded per second"""
+    states = games(10_000)
+    size = len(json.dumps(states, cls=StatesEncoder))
+    seconds, spread = median_of(lambda _: json.dumps(states, cls=StatesEncoder), 1)
+    return size / seconds / 1e6, spread
+
+
+def bench_cooldowns() -> (Sample, Sample):
+    """Microseconds to check and to add a cooldown"""
+    number = 10_000
+    cooldowns = Cooldowns()
+    keys = [(CooldownType.GUESS, author, (author % 100, 0)) for author in range(number)]
+    for key in keys:
+        cooldowns.add_for(key, 1)
+
+    def check(_):
+        for key in keys:
+            if key in cooldowns:
+                cooldowns[key].expired()
+
+    def insert(_):
+        for key in keys:
+            cooldowns.add_for(key, 1)
+    return median_of(check, number, scale=1e6), median_of(insert, number, scale=1e6)
+
+
+def bench_memory(phrase: str) -> Sample:
+    """KiB of memory allocated per running game"""
+    number = 1_000
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    running = []
+    for author in range(number):
+        game = Running(phrase, author_id=0, author_name="bench", post_id=author)
+        for letter in "etaoin":
+            game.guess(letter, Member(author + 1))
+        running.append(game)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Allocations are deterministic, so there's no spread
+    return (after - before) / number / 1024, 0.0
+
+
+def measure(sizes: [int]) -> {str: Sample}:
+    """Runs all benchmarks. Metric names end with their unit, all are better if lower except
+    throughput (`_mb_s`)."""
+    metrics = {
+        'guess_short_us': bench_guess(SHORT_PHRASE),
+        'guess_long_us': bench_guess(LONG_PHRASE),
+        'render_short_us': bench_render(SHORT_PHRASE),
+        'render_long_us': bench_render(LONG_PHRASE),
+    }
+    for size in sizes:
+        metrics[f"states_save_{size}_ms"], metrics[f"states_load_{size}_ms"] = \
+            bench_states(size)
+    metrics['states_encode_mb_s'] = bench_encode()
+    metrics['cooldowns_check_us'], metrics['cooldowns_insert_us'] = bench_cooldowns()
+    metrics['memory_short_game_kib'] = bench_memory(SHORT_PHRASE)
+    metrics['memory_long_game_kib'] = bench_memory(LONG_PHRASE)
+    return metrics
+
+
+def noise_floor(name: str) -> float:
+    """Returns the absolute change of the metric which is still considered noise"""
+    for unit, floor in NOISE_FLOORS.items():
+        if name.endswith(unit):
+            return floor
+    return 0
+
+
+def compare(metrics: {str: Sample}, baseline: {str: Sample}, threshold: float) -> [str]:
+    """Prints all metrics and returns the names of the ones regressed beyond the threshold plus
+    the larger spread of the current and the baseline measurements and the noise floor"""
+    regressions = []
+    for name, (value, spread) in metrics.items():
+        base, base_spread = baseline.get(name, (None, 0))
+        if not base:
+            print(f"{name:28} {value:12.3f} ±{spread:4.0%}   (no baseline)")
+            continue
+        change = value / base - 1
+        if name.endswith("_mb_s"):
+            change = -change
+        regressed = change > threshold + max(spread, base_spread) \
+            and abs(value - base) > noise_floor(name)
+        if regressed:
+            regressions.append(name)
+        print(f"{name:28} {value:12.3f} ±{spread:4.0%}   baseline {base:12.3f} "
+              f"±{base_spread:4.0%}   {change:+7.1%}{'   REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    """Runs the suite"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--update", action="store_true",
+                        help="store the measured metrics as new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="relative change of a metric which counts as regression")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="comma separated numbers of games to persist")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline file")
+    args = parser.parse_args()
+
+    metrics = measure([int(size) for size in args.sizes.split(",")])
+    if args.update:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump({name: {'value': round(value, 4), 'spread': round(spread, 4)}
+                       for name, (value, spread) in metrics.items()}, baseline_file, indent=2)
+            baseline_file.write("\n")
+        compare(metrics, {}, args.threshold)
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    try:
+        with open(args.baseline, "r") as baseline_file:
+            baseline = {name: (metric['value'], metric['spread'])
+                        for name, metric in json.load(baseline_file).items()}
+    except OSError:
+        baseline = {}
+        print(f"No baseline in {args.baseline}, record one with --update "
+              f"(make bench-baseline) to compare")
+    regressions = compare(metrics, baseline, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} metrics regressed by more than {args.threshold:.0%}: "
+              f"{', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Benchmarks drawing random phrases from a large word list index.
+
+Generates a multi-megabyte word list, compiles it and reports build time, selection latency
+and the memory of the process before and after opening the index. The resident set size
+includes the pages of the mapped index which were touched, the Python heap should stay flat.
+
+    python3 benchmarks/wordlist.py [phrase count]
+"""
+
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "hangmanbot"))
+os.environ.setdefault("TOKEN", "benchmark")
+
+# pylint: disable=wrong-import-position
+from wordlist import WordList, build
+
+DRAWS = 100_000
+
+
+def rss_kib() -> int:
+    """Returns the current resident set size of this process in KiB"""
+    with open("/proc/self/statm", "r") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def generate(path: str, count: int):
+    """Writes `count` random phrases with 3 to 30 characters"""
+    with open(path, "w", encoding="utf-8") as wordlist:
+        for _ in range(count):
+            length = random.randint(3, 30)
+            wordlist.write("".join(random.choices(string.ascii_lowercase, k=length)) + "\n")
+
+
+def measure(wordlist: WordList, length: int = None, category: str = None) -> float:
+    """Returns the mean latency of drawing a phrase in microseconds"""
+    start = time.perf_counter()
+    for _ in range(DRAWS):
+        wordlist.random(length=length, category=category)
+    return (time.perf_counter() - start) / DRAWS * 1e6
+
+
+def main(count: int):
+    """Runs the benchmark"""
+    with tempfile.TemporaryDirectory() as directory:
+        lists = {}
+        for category in ("alpha", "beta", "gamma"):
+            lists[category] = os.path.join(directory, f"{category}.txt")
+            generate(lists[category], count // 3)
+        size = sum(os.path.getsize(path) for path in lists.values())
+
+        index_file = os.path.join(directory, "wordlists.idx")
+        start = time.perf_counter()
+        build(lists, index_file)
+        print(f"build:            {time.perf_counter() - start:.2f}s "
+              f"({size / 2 ** 20:.1f} MiB source, "
+              f"{os.path.getsize(index_file) / 2 ** 20:.1f} MiB index)")
+
+        before = rss_kib()
+        tracemalloc.start()
+        wordlist = WordList(index_file)
+        for _ in range(1000):
+            wordlist.random()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"phrases:          {len(wordlist)}")
+        print(f"random():         {measure(wordlist):.2f}us")
+        print(f"random(10):       {measure(wordlist, length=10):.2f}us")
+        print(f"random(10, beta): {measure(wordlist, length=10, category='beta'):.2f}us")
+        print(f"python heap:      +{peak // 1024} KiB peak while opening and drawing")
+        print(f"rss:              +{rss_kib() - before} KiB (incl. mapped index pages)")
+        wordlist.close()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 600_000)
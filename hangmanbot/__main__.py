@@ -1,74 +1,264 @@
 """Discord Bot implementing a simple Hangman game."""
 
+import asyncio
 import logging
+import os
+import re
+import signal
+import tempfile
 import discord
 from discord.ext import commands
-from settings import DISCORD_TOKEN
-from states import States, Running, Solved, Failed
-from cooldowns import Cooldowns, CooldownType
+import lifecycle
+from settings import DISCORD_TOKEN, WORDLISTS_DIR, COMMAND_QUEUE_DEPTH, SHUTDOWN_TIMEOUT, \
+    GUESS_COMPONENTS, LAG_THRESHOLD_MS, LAG_REPORTS_FILE
+from states import States, State, Running, Solved, Failed, GameKey, game_key
+from cooldowns import Cooldowns, CooldownType, Scope
+from guesses import active_cooldown, apply_guess
+from queues import Command, CommandQueues
+from profiling import Profiler, MAX_SECONDS as MAX_PROFILE_SECONDS
+from watchdog import LoopWatchdog
+from components import ComponentGuesses, GuessView
+from wordlist import WordList
 
 logging.basicConfig(level=logging.DEBUG)
 
+# A bot which is still running flushes its state before it's loaded by this process
+lifecycle.take_over(SHUTDOWN_TIMEOUT)
 
 states = States.load()
 
 cooldowns = Cooldowns.load()
 
-bot = commands.Bot(command_prefix="!")
+wordlist = WordList.load()
+wordlist_lock = asyncio.Lock()
+
+command_queues = CommandQueues(COMMAND_QUEUE_DEPTH)
+
+profiler = Profiler()
+
+watchdog = LoopWatchdog(interval=0.1, threshold=LAG_THRESHOLD_MS / 1000,
+                        report_file=LAG_REPORTS_FILE)
+
+# Commands are read from the content of messages, which is a privileged intent
+intents = discord.Intents.default()
+intents.message_content = True
+bot = commands.Bot(command_prefix="!", intents=intents)
+
+shutting_down = False
+
+component_guesses = None
+if GUESS_COMPONENTS:
+    component_guesses = ComponentGuesses(states, cooldowns, command_queues,
+                                          accepting=lambda: not shutting_down)
+
+
+@bot.check
+async def __accepting_commands(_ctx: commands.Context) -> bool:
+    """Rejects all commands while shutting down"""
+    return not shutting_down
+
+
+async def __shutdown():
+    """Stops accepting commands, processes queued guesses, persists everything and logs out"""
+    global shutting_down
+    if shutting_down:
+        return
+    shutting_down = True
+    logging.info("Shutting down, processing queued guesses")
+    remaining = await command_queues.drain(SHUTDOWN_TIMEOUT)
+    if remaining:
+        logging.warning("Dropped %d queued guesses on shutdown", remaining)
+    await asyncio.gather(states.flush(), cooldowns.flush())
+    await bot.close()
 
 
 @bot.event
 async def on_ready():
     """Runs if the bot is ready"""
     logging.info("Logged in as %s", bot.user)
+    if component_guesses and not bot.persistent_views:
+        # Handles the menus of all game posts, including the ones posted before a restart
+        bot.add_view(GuessView(on_guess=component_guesses.on_guess))
+
+
+UNKNOWN_COOLDOWN = "Unknown cooldown type '{}'. " \
+                   "Supported: 'rm|remove', 'g|guess', 's|start_hangman', 'state'"
+
+
+def __guild_id(ctx: commands.Context) -> int:
+    """Returns the id of the guild of the context or 0 outside of guilds"""
+    return ctx.guild.id if ctx.guild else 0
 
 
 @bot.command(name="cooldown-get", aliases=["cd", "cooldown"], help="Get the cooldown value for a command")
 @commands.has_permissions(administrator=True)
 async def __get_cooldown(ctx: commands.Context, cd_type: str = None):
-    channel_id = ctx.channel.id
-    cd_type = cd_type.strip().lower()
-
-    if cd_type in {'rm', 'remove'}:
-        value = cooldowns.get_cooldown((CooldownType.REMOVE, channel_id))
-    elif cd_type in {'guess', 'g'}:
-        value = cooldowns.get_cooldown((CooldownType.GUESS, channel_id))
-    elif cd_type in {'s', 'start_hangman'}:
-        value = cooldowns.get_cooldown((CooldownType.START, channel_id))
-    else:
-        await ctx.send(f"Unknown cooldown type '{cd_type}'. "
-                       f"Supported: 'rm|remove', 'g|guess', 's|start_hangman'", delete_after=5)
+    channel_id, _ = game_key(ctx.channel)
+    parsed = CooldownType.parse(cd_type) if cd_type else None
+    if not parsed:
+        await ctx.send(UNKNOWN_COOLDOWN.format(cd_type), delete_after=5)
         return
-    value = f"{value.seconds}s" if value else "None"
-    await ctx.send(f"Cooldown for '{cd_type}' in this channel: {value}")
 
+    value = cooldowns.get_cooldown((parsed, __guild_id(ctx), channel_id))
+    policy = cooldowns.policy(parsed, __guild_id(ctx), channel_id)
+    configured = ", ".join(f"{scope.name.lower()}: {'-' if seconds is None else f'{seconds}s'}"
+                           for scope, seconds in policy.items())
+    await ctx.send(f"Cooldown for '{cd_type}' in this channel: {value.seconds}s ({configured})")
 
-@bot.command(name="cooldown-edit", aliases=["cd-edit", "cd-e"], help="Edit/Set the cooldown value for a command")
+
+@bot.command(name="cooldown-edit", aliases=["cd-edit", "cd-e"],
+             help="Edit/Set the cooldown value for a command. "
+                  "Applies to this channel, the mentioned channels, 'guild' or 'global'. "
+                  "'reset' as value removes the value")
 @commands.has_permissions(administrator=True)
-async def __cooldown_edit(ctx: commands.Context, cd_type: str, value: int):
-    channel_id = ctx.channel.id
-    cd_type = cd_type.strip().lower()
-
-    if cd_type in {'rm', 'remove'}:
-        cooldowns.set_cooldown((CooldownType.REMOVE, channel_id), value)
-    elif cd_type in {'guess', 'g'}:
-        cooldowns.set_cooldown((CooldownType.GUESS, channel_id), value)
-    elif cd_type in {'s', 'start_hangman'}:
-        cooldowns.set_cooldown((CooldownType.START, channel_id), value)
+async def __cooldown_edit(ctx: commands.Context, cd_type: str, value: str, *targets: str):
+    parsed = CooldownType.parse(cd_type)
+    if not parsed:
+        await ctx.send(UNKNOWN_COOLDOWN.format(cd_type))
+        return
+    if value.lower() == "reset":
+        seconds = None
+    elif value.isdigit():
+        seconds = int(value)
+    else:
+        await ctx.send(f"Value has to be seconds or 'reset', not '{value}'", delete_after=5)
+        return
+
+    targets = [target.lower() for target in targets]
+    mentions = {f"<#{channel.id}>" for channel in ctx.message.channel_mentions}
+    unknown = [target for target in targets
+               if target not in {"global", "guild"} and target not in mentions]
+    if unknown:
+        await ctx.send(f"Unknown target {', '.join(unknown)}. "
+                       f"Supported: 'guild', 'global' or mentioned channels", delete_after=5)
+        return
+    if "global" in targets:
+        if not await bot.is_owner(ctx.author):
+            await ctx.send("Only the owner of the bot can set global cooldowns", delete_after=5)
+            return
+        scope, scope_ids, target = Scope.GLOBAL, [0], "all servers"
+    elif "guild" in targets:
+        scope, scope_ids, target = Scope.GUILD, [__guild_id(ctx)], "this server"
+    elif ctx.message.channel_mentions:
+        # Games in threads use the values of their parent channel
+        scope_ids = list(dict.fromkeys(game_key(channel)[0]
+                                       for channel in ctx.message.channel_mentions))
+        scope, target = Scope.CHANNEL, ", ".join(f"<#{channel_id}>" for channel_id in scope_ids)
+    else:
+        channel_id, _ = game_key(ctx.channel)
+        scope, scope_ids, target = Scope.CHANNEL, [channel_id], "this channel"
+
+    cooldowns.set_cooldowns(parsed, scope, scope_ids, seconds)
+    if seconds is None:
+        await ctx.send(f"Successfully reset cooldown of '{cd_type}' for {target}")
     else:
-        await ctx.send(f"Unknown cooldown type '{cd_type}'. "
-                       f"Supported: 'rm|remove', 'g|guess', 's|start_hangman'")
+        await ctx.send(f"Successfully set cooldown of '{cd_type}' to {seconds}s for {target}")
+
+
+@bot.command(name="metrics", help="Show the depth of the command queues and shed commands")
+@commands.has_permissions(administrator=True)
+async def __metrics(ctx: commands.Context):
+    key = game_key(ctx.channel)
+    metrics = command_queues.metrics()
+    metrics['channel_depth'] = command_queues.depths().get(key, 0)
+    lines = "\n".join(f"{name}: {value}" for name, value in metrics.items())
+    await ctx.send(f"```{lines}```", delete_after=60)
+
+
+async def __send_profile(ctx: commands.Context, capture, seconds: int):
+    if seconds < 1:
+        await ctx.send("Captures take at least 1 second", delete_after=5)
         return
+    if profiler.running:
+        await ctx.send("Another capture is still running", delete_after=5)
+        return
+    if seconds > MAX_PROFILE_SECONDS:
+        await ctx.send(f"Captures take at most {MAX_PROFILE_SECONDS}s", delete_after=5)
+        seconds = MAX_PROFILE_SECONDS
+    await ctx.send(f"Capturing for {seconds}s...", delete_after=seconds)
+    path, summary = await capture(seconds)
+    # Discord messages are limited to 2000 characters, the full summary is in the file
+    await ctx.send(f"Written to `{path}`\n```{summary[:1800]}```")
+
 
-    await ctx.send(f"Successfully set cooldown of '{cd_type}' to {value}s")
+@bot.command(name="profile", help="Profile the bot for the given seconds (default 30)")
+@commands.is_owner()
+async def __profile(ctx: commands.Context, seconds: int = 30):
+    await __send_profile(ctx, profiler.profile_cpu, seconds)
+
+
+@bot.command(name="profile-memory", aliases=["profile-mem"],
+             help="Trace memory allocations of the bot for the given seconds (default 30)")
+@commands.is_owner()
+async def __profile_memory(ctx: commands.Context, seconds: int = 30):
+    await __send_profile(ctx, profiler.profile_memory, seconds)
+
+
+@bot.command(name="lag", help="Show the event loop lag histogram and what blocked the loop")
+@commands.is_owner()
+async def __lag(ctx: commands.Context):
+    await ctx.send(f"```{watchdog.summary()}```\nStacks are written to `{LAG_REPORTS_FILE}`",
+                   delete_after=120)
+
+
+@bot.command(name="wordlist-add", aliases=["wl-add"],
+             help="Add the attached text file (one phrase per line) as word list for random games")
+@commands.has_permissions(administrator=True)
+async def __add_wordlist(ctx: commands.Context, category: str):
+    global wordlist
+    category = category.strip().lower()
+    if not re.fullmatch(r"[a-z0-9_-]+", category):
+        await ctx.send("Category may only contain letters, digits, '-' and '_'", delete_after=5)
+        return
+    if not ctx.message.attachments:
+        await ctx.send("Attach a text file with one phrase per line", delete_after=5)
+        return
+
+    # The upload only replaces a word list once it compiled, an invalid file would otherwise
+    # break every following build
+    os.makedirs(WORDLISTS_DIR, exist_ok=True)
+    upload, upload_path = tempfile.mkstemp(suffix=".upload", dir=WORDLISTS_DIR)
+    os.close(upload)
+    try:
+        await ctx.message.attachments[0].save(upload_path)
+        # One upload at a time, otherwise a build misses the list of a concurrent upload
+        async with wordlist_lock:
+            # Compiling large lists takes a while, so don't block the event loop
+            new_wordlist = await asyncio.get_event_loop().run_in_executor(
+                None, WordList.add, category, upload_path)
+            old_wordlist, wordlist = wordlist, new_wordlist
+    except ValueError as err:
+        await ctx.send(f"Word list '{category}' rejected: {err}", delete_after=10)
+        return
+    finally:
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+    old_wordlist.close()
+    await ctx.send(f"Word list '{category}' added. Categories: {', '.join(wordlist.categories)}")
+
+
+async def __random_phrase(ctx: commands.Context, args: [str]) -> str:
+    """Draws a phrase for `!s random [length] [category]` or notifies if there is none"""
+    length, category = None, None
+    for arg in args:
+        if arg.isdigit():
+            length = int(arg)
+        else:
+            category = arg.lower()
+    phrase = wordlist.random(length=length, category=category)
+    if not phrase:
+        await ctx.send(f"No phrase found for length {length or 'any'} and "
+                       f"category {category or 'any'}. "
+                       f"Categories: {', '.join(wordlist.categories)}", delete_after=10)
+    return phrase
 
 
 @bot.command(name="remove", aliases=["rm"], help="Remove the current game")
 async def __remove(ctx: commands.Context):
-    channel_id = ctx.channel.id
+    key = game_key(ctx.channel)
     author_id = ctx.author.id
-    cooldown_id = (CooldownType.REMOVE, author_id, channel_id)
-    if (channel_id not in states) or (not isinstance(states[channel_id], Running)):
+    cooldown_id = (CooldownType.REMOVE, author_id, key)
+    if (key not in states) or (not isinstance(states[key], Running)):
         await ctx.send("No game to reset...", delete_after=2)
     if cooldown_id in cooldowns:
         cooldown = cooldowns[cooldown_id]
@@ -77,12 +267,12 @@ async def __remove(ctx: commands.Context):
             await ctx.send(f"{ctx.author.mention} removing allowed in {expires_in}s",
                            delete_after=expires_in)
             return
-    state = states[channel_id]
+    state = states[key]
     if isinstance(state, Running):
         if state.author_id == author_id or ctx.author.server_permissions.administrator:
             message = await ctx.fetch_message(state.post_id)
             await message.delete()
-            del states[channel_id]
+            del states[key]
             await ctx.send("Current game was removed!", delete_after=2)
         else:
             await ctx.send("You're not allowed to reset the game "
@@ -92,14 +282,14 @@ async def __remove(ctx: commands.Context):
 @bot.command(name="state", help="Repost the game state message")
 @commands.bot_has_permissions(manage_messages=True)
 async def __post_state(ctx: commands.Context):
-    channel_id = ctx.channel.id
+    key = game_key(ctx.channel)
     author_id = ctx.author.id
-    cooldown_id = (CooldownType.STATE, author_id, channel_id)
+    cooldown_id = (CooldownType.STATE, author_id, key)
 
     # Delete !state message
     await ctx.message.delete()
 
-    if channel_id not in states:
+    if key not in states:
         await ctx.send("No Game running!", delete_after=5)
         return
 
@@ -113,26 +303,27 @@ async def __post_state(ctx: commands.Context):
                            delete_after=expires_in)
             return
 
-    state = states[channel_id]
+    state = states[key]
     # Create new state and only delet old state if new state posting was successful
     old_message = await ctx.fetch_message(state.post_id)
-    new_message = await ctx.send(f"{state}")
+    new_message = await ctx.send(f"{state}", **__components(state))
     state.post_id = new_message.id
     # Re-Add so it's stored properly
-    states[channel_id] = state
+    states[key] = state
     await old_message.delete()
 
-    cooldowns.add_for(cooldown_id)
+    cooldowns.add_for(cooldown_id, __guild_id(ctx))
 
 
 @bot.command(name="start_hangman", aliases=["s"], help="Start a new game")
 @commands.bot_has_permissions(manage_messages=True)
 async def __start_hangman(ctx: commands.Context, *, phrase: str):
-    channel_id = ctx.channel.id
+    key = game_key(ctx.channel)
     author_id = ctx.author.id
-    cooldown_id = (CooldownType.START, author_id, channel_id)
+    cooldown_id = (CooldownType.START, author_id, key)
 
-    if (channel_id in states) and isinstance(states[channel_id], Running):
+    spawn_thread = (key in states) and isinstance(states[key], Running)
+    if spawn_thread and not hasattr(ctx.channel, "create_thread"):
         await ctx.send("A game is still running!", delete_after=2)
         return
 
@@ -146,38 +337,52 @@ async def __start_hangman(ctx: commands.Context, *, phrase: str):
                            delete_after=expires_in)
             return
 
+    args = phrase.split()
+    random_game = args[0].lower() == "random"
+    if random_game:
+        phrase = await __random_phrase(ctx, args[1:])
+        if not phrase:
+            return
+
     phrase = phrase.replace("!start_hangman", "").strip(" |")
     if len(phrase) <= 2:
         await ctx.send("Phrase has to be at least 3 characters long", delete_after=10)
         return
-    if not isinstance(ctx.channel, discord.TextChannel) and not isinstance(
-            ctx.channel, discord.GroupChannel):
+    if not isinstance(ctx.channel, (discord.TextChannel, discord.GroupChannel,
+                                    getattr(discord, "Thread", discord.TextChannel))):
         await ctx.send("Can only start hangman in text or group channels", delete_after=10)
         return
 
     await ctx.message.delete()
 
-    state = Running(phrase, author_id=ctx.author.id, author_name=ctx.author.display_name)
-    cooldowns.add_for(cooldown_id)
-
-    message = await ctx.send(f"{state}")
+    if random_game:
+        # Nobody knows the phrase of random games, so everyone (including the starter) can guess
+        state = Running(phrase, author_id=bot.user.id, author_name=bot.user.display_name)
+    else:
+        state = Running(phrase, author_id=ctx.author.id, author_name=ctx.author.display_name)
+    cooldowns.add_for(cooldown_id, __guild_id(ctx))
+
+    channel = ctx.channel
+    if spawn_thread:
+        # Host additional games in their own thread, which has its own rate limits
+        channel = await ctx.channel.create_thread(name=f"Hangman by {state.author_name}",
+                                                  type=discord.ChannelType.public_thread)
+        key = game_key(channel)
+    message = await channel.send(f"{state}", **__components(state))
     state.post_id = message.id
-    states[channel_id] = state
+    states[key] = state
 
 
 @bot.command(name="guess", aliases=["g"], help="Guess a character or the whole phrase")
 @commands.bot_has_permissions(manage_messages=True)
 async def __guess(ctx: commands.Context, *, guess: str):
-    channel_id = ctx.channel.id
+    key = game_key(ctx.channel)
     author_id = ctx.author.id
-    guess_cooldown_id = (CooldownType.GUESS, author_id, channel_id)
-    remove_cooldown_id = (CooldownType.REMOVE, author_id, channel_id)
-    start_cooldown_id = (CooldownType.START, author_id, channel_id)
 
     # Delete message at last to remove spam
     await ctx.message.delete(delay=2)
 
-    if channel_id not in states:
+    if key not in states:
         await ctx.send(
             "No guess running in this channel. "
             "Please start with `!s ||<phrase>||` first",
@@ -185,62 +390,64 @@ async def __guess(ctx: commands.Context, *, guess: str):
         )
         return
 
-    old_state = states[channel_id]
+    old_state = states[key]
     if isinstance(old_state, Running) and old_state.author_id == author_id:
         await ctx.send("Authors are only allowed to reset the current game!", delete_after=5)
         return
 
-    if guess_cooldown_id in cooldowns:
-        cooldown = cooldowns[guess_cooldown_id]
-        if cooldown.expired():
-            del cooldowns[guess_cooldown_id]
-        else:
-            expires_in = cooldown.expires_in()
-            await ctx.send(f"{ctx.author.mention} still has a cooldown of {expires_in}s!",
-                           delete_after=expires_in)
-            return
-
+    # Guesses of a game are processed one after another. Guesses which can't change the game
+    # anymore are dropped, so a flood of guesses doesn't pile up behind the rate limits.
     guess = guess.strip()
-    new_state = old_state.guess(guess, ctx.author)
-    states[channel_id] = new_state
+    command = Command(name=guess.lower(),
+                      handler=lambda: __process_guess(ctx, key, old_state, guess),
+                      valid=lambda: key in states and states[key] is old_state)
+    command_queues.submit(key, command)
+
+
+def __components(state: State) -> dict:
+    """Returns the message arguments to attach the guess menus to the post of the game"""
+    if not GUESS_COMPONENTS:
+        return {}
+    if not isinstance(state, Running):
+        return {'view': None}
+    return {'view': GuessView.render(state.guessed)}
+
+
+async def __process_guess(ctx: commands.Context, key: GameKey, old_state: Running, guess: str):
+    cooldown = active_cooldown(cooldowns, (CooldownType.GUESS, ctx.author.id, key))
+    if cooldown:
+        expires_in = cooldown.expires_in()
+        await ctx.send(f"{ctx.author.mention} still has a cooldown of {expires_in}s!",
+                       delete_after=expires_in)
+        return
 
-    if isinstance(new_state, (Solved, Failed)):
-        # Unveil all remaining characters in old state if solved
-        assert isinstance(old_state, Running)
-        if isinstance(new_state, Solved):
-            old_state.unveil()
-        # Update Message to show hanged man
-        message = await ctx.fetch_message(old_state.post_id)
-        await message.edit(content=f"{old_state}")
+    new_state = apply_guess(states, cooldowns, key, old_state, guess, ctx.author,
+                            __guild_id(ctx))
 
+    # Update game post, which shows the hanged man if the game is over
+    message = await ctx.fetch_message(old_state.post_id)
+    await message.edit(content=f"{old_state}", **__components(new_state))
+    if isinstance(new_state, (Solved, Failed)):
         # Create new post so everyone is mentioned properly and gamestate is still
         # visible after the game was finished
         await ctx.send(f"{new_state}")
 
-        # Also add Cooldown for users which started the game so others can start a game
-        cooldowns.add_for(start_cooldown_id)
-
-        del states[channel_id]
-        # Cooldown on remove should be cleared to save space
-        del cooldowns[remove_cooldown_id]
-    if isinstance(new_state, Running):
-        # Edit game post if still running
-        message = await ctx.fetch_message(new_state.post_id)
-        await message.edit(content=f"{new_state}")
-
-        if new_state.guessing_started() and (remove_cooldown_id not in cooldowns):
-            cooldowns.add_for(remove_cooldown_id)
-    cooldowns.clear(CooldownType.GUESS)
-    cooldowns.add_for(guess_cooldown_id)
-
 
 @__start_hangman.error
 @__guess.error
 @__remove.error
 @__cooldown_edit.error
 @__get_cooldown.error
+@__add_wordlist.error
+@__metrics.error
+@__profile.error
+@__profile_memory.error
+@__lag.error
 @__post_state.error
 async def __handle_error(ctx: commands.Context, error):
+    if shutting_down and isinstance(error, commands.CheckFailure):
+        logging.debug("Rejected command while shutting down: %s", ctx.message.content)
+        return
     if isinstance(error, commands.BotMissingPermissions):
         await ctx.channel.send(
             "Missing permission: manage_messages (to delete its own and command messages)"
@@ -249,5 +456,32 @@ async def __handle_error(ctx: commands.Context, error):
     logging.error("Error: %s", error)
 
 
+def main():
+    """Runs the bot until SIGTERM/SIGINT and shuts it down gracefully"""
+    # get_event_loop() doesn't create a loop outside of a running loop in newer Python versions
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    # Name the handler in reports if the loop gets blocked
+    for command in bot.commands:
+        watchdog.register(command.callback, f"!{command.name}")
+    watchdog.register(__process_guess, "!guess (queued)")
+    if GUESS_COMPONENTS:
+        watchdog.register(ComponentGuesses.on_guess, "guess menu")
+        watchdog.register(ComponentGuesses.process, "guess menu (queued)")
+    watchdog.start(loop)
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, lambda: asyncio.ensure_future(__shutdown()))
+        except NotImplementedError:
+            # Signal handlers aren't supported by the event loop on Windows
+            pass
+    try:
+        loop.run_until_complete(bot.start(DISCORD_TOKEN))
+    finally:
+        if not shutting_down:
+            loop.run_until_complete(asyncio.gather(states.flush(), cooldowns.flush()))
+        lifecycle.release()
+
+
 if __name__ == '__main__':
-    bot.run(DISCORD_TOKEN)
+    main()
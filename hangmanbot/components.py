@@ -0,0 +1,134 @@
+"""Message components to guess letters without sending messages"""
+
+import string
+from typing import Awaitable, Callable
+
+import discord
+
+from cooldowns import Cooldowns, CooldownType
+from guesses import active_cooldown, apply_guess
+from queues import Command, CommandQueues, ShedReason
+from states import States, Running, Solved, Failed, GameKey, game_key
+
+CUSTOM_ID = "hangman:guess:{}"
+# Select menus are limited to 25 options, so the alphabet is split in two menus
+LETTER_GROUPS = (string.ascii_lowercase[:13], string.ascii_lowercase[13:])
+
+
+class GuessView(discord.ui.View):
+    """Select menus offering the letters which weren't guessed yet.
+
+    The menus have fixed custom ids, so a single view registered with `Bot.add_view` handles
+    the guesses of all games, including games posted before a restart. Views attached to game
+    posts are only used for rendering and should be stopped (see `render`), otherwise
+    discord.py keeps one view per post.
+    """
+
+    def __init__(self, on_guess: Callable[[discord.Interaction, str], Awaitable] = None,
+                 guessed: {str} = frozenset()):
+        super().__init__(timeout=None)
+        for index, letters in enumerate(LETTER_GROUPS):
+            options = [discord.SelectOption(label=letter.upper(), value=letter)
+                       for letter in letters if letter not in guessed]
+            if not options:
+                continue
+            select = discord.ui.Select(custom_id=CUSTOM_ID.format(index), options=options,
+                                       placeholder=f"Guess {letters[0].upper()} - "
+                                                   f"{letters[-1].upper()}")
+            if on_guess:
+                select.callback = self.__callback(select, on_guess)
+            self.add_item(select)
+
+    @staticmethod
+    def __callback(select: discord.ui.Select,
+                   on_guess: Callable[[discord.Interaction, str], Awaitable]):
+        async def callback(interaction: discord.Interaction):
+            await on_guess(interaction, select.values[0])
+        return callback
+
+    @classmethod
+    def render(cls, guessed: {str}) -> discord.ui.View:
+        """Returns the menus to attach to a game post, None if every letter was guessed"""
+        view = cls(guessed=guessed)
+        view.stop()
+        return view if view.children else None
+
+
+SHED_REPLIES = {
+    ShedReason.DUPLICATE: "This letter is already being guessed",
+    ShedReason.FINISHED: "This game is already over",
+    ShedReason.FULL: "Too many guesses at once, try again in a moment",
+}
+
+
+class ComponentGuesses:
+    """Processes the letters guessed with the menus of game posts (`on_guess` of `GuessView`).
+
+    Guesses are queued in the command queue of the game like `!guess`, so edits of a post land
+    in order. Interactions have to be answered within 3 seconds, which the queue can't promise
+    as it's shared with `!guess` and its rate limited calls. So accepted guesses are answered
+    (deferred) right away, and the queued guess edits the post through the interaction or
+    tells the guesser in a followup why it was rejected. Followups can be sent for 15 minutes.
+    """
+    __states: States
+    __cooldowns: Cooldowns
+    __command_queues: CommandQueues
+    __accepting: Callable[[], bool]
+
+    def __init__(self, states: States, cooldowns: Cooldowns, command_queues: CommandQueues,
+                 accepting: Callable[[], bool]):
+        self.__states = states
+        self.__cooldowns = cooldowns
+        self.__command_queues = command_queues
+        self.__accepting = accepting
+
+    def __running(self, key: GameKey, post_id: int) -> Running:
+        """Returns the game if it's still running in the post"""
+        state = self.__states[key] if key in self.__states else None
+        if isinstance(state, Running) and state.post_id == post_id:
+            return state
+        return None
+
+    async def on_guess(self, interaction: discord.Interaction, letter: str):
+        """Queues a guessed letter or answers why it isn't processed"""
+        if not self.__accepting():
+            await interaction.response.send_message(
+                "The bot is restarting, please guess again in a moment", ephemeral=True)
+            return
+        key = game_key(interaction.channel)
+        post_id = interaction.message.id
+        old_state = self.__running(key, post_id)
+        if old_state and old_state.author_id == interaction.user.id:
+            await interaction.response.send_message(
+                "Authors are only allowed to reset the current game!", ephemeral=True)
+            return
+
+        await interaction.response.defer()
+
+        async def shed(reason: ShedReason):
+            await interaction.followup.send(SHED_REPLIES[reason], ephemeral=True)
+
+        command = Command(name=letter, handler=lambda: self.process(interaction, key, letter),
+                          valid=lambda: self.__running(key, post_id) is not None, on_shed=shed)
+        reason = self.__command_queues.submit(key, command)
+        if reason:
+            await shed(reason)
+
+    async def process(self, interaction: discord.Interaction, key: GameKey, letter: str):
+        """Applies a queued guess to the game and updates the post of the deferred interaction"""
+        cooldown = active_cooldown(self.__cooldowns,
+                                   (CooldownType.GUESS, interaction.user.id, key))
+        if cooldown:
+            await interaction.followup.send(
+                f"You still have a cooldown of {cooldown.expires_in()}s!", ephemeral=True)
+            return
+
+        old_state = self.__states[key]
+        new_state = apply_guess(self.__states, self.__cooldowns, key, old_state, letter,
+                                interaction.user, interaction.guild_id or 0)
+        view = GuessView.render(new_state.guessed) if isinstance(new_state, Running) else None
+        await interaction.edit_original_response(content=f"{old_state}", view=view)
+        if isinstance(new_state, (Solved, Failed)):
+            # Followups aren't rate limited with the messages of the channel, which would hold
+            # up the guesses queued behind this one
+            await interaction.followup.send(f"{new_state}")
@@ -2,13 +2,15 @@
 
 import json
 import logging
-import sys
-import os
 from datetime import datetime
 from enum import IntEnum
 from typing import Any
 
-from settings import CONFIG_DIR, COOLDOWNS_FILE
+from settings import COOLDOWNS_FILE
+from persistence import Persister
+
+# Same as states.GameKey, which can't be imported without discord
+GameKey = (int, int)
 
 
 class CooldownType(IntEnum):
@@ -19,16 +21,49 @@ class CooldownType(IntEnum):
     START = 3
     STATE = 4
 
+    @classmethod
+    def parse(cls, name: str):
+        """Returns the type for a command name or alias, None if there is no cooldown for it"""
+        return COOLDOWN_ALIASES.get(name.strip().lower())
+
+
+COOLDOWN_ALIASES: {str: CooldownType} = {
+    'rm': CooldownType.REMOVE,
+    'remove': CooldownType.REMOVE,
+    'g': CooldownType.GUESS,
+    'guess': CooldownType.GUESS,
+    's': CooldownType.START,
+    'start_hangman': CooldownType.START,
+    'state': CooldownType.STATE,
+}
+
+
+class Scope(IntEnum):
+    """Scope of a cooldown value. Values of narrower scopes override wider ones."""
+
+    GLOBAL = 0
+    GUILD = 1
+    CHANNEL = 2
+
 
 class Cooldown:
     """A Cooldown of a single user"""
     __created: datetime
     seconds: int
 
-    def __init__(self, seconds: int):
-        self.__created = datetime.now()
+    @classmethod
+    def from_json(cls, data: dict):
+        """Parses this class from json deserialized data"""
+        return cls(data['seconds'], created=datetime.fromtimestamp(data['created']))
+
+    def __init__(self, seconds: int, created: datetime = None):
+        self.__created = created if created else datetime.now()
         self.seconds = seconds
 
+    def to_json(self) -> dict:
+        """Returns the json serializable data of this cooldown"""
+        return {'seconds': self.seconds, 'created': self.__created.timestamp()}
+
     def __seconds_since(self) -> int:
         now = datetime.now()
         since = now - self.__created
@@ -53,26 +88,51 @@ DEFAULT_RM_COOLDOWN: int = 60
 DEFAULT_START_COOLDOWN: int = 20
 DEFAULT_GUESS_COOLDOWN: int = 5
 DEFAULT_STATE_COOLDOWN: int = 60
+DEFAULTS: {CooldownType: int} = {
+    CooldownType.REMOVE: DEFAULT_RM_COOLDOWN,
+    CooldownType.START: DEFAULT_START_COOLDOWN,
+    CooldownType.GUESS: DEFAULT_GUESS_COOLDOWN,
+    CooldownType.STATE: DEFAULT_STATE_COOLDOWN,
+}
 
 
 class Cooldowns:
-    """Manages cooldown for different commands based on channel."""
+    """Manages cooldown for different commands based on channel.
+
+    Cooldown values are configured globally, per guild or per channel (`cooldown_values` maps
+    (type, scope, guild or channel id) to seconds) and resolved in that order of precedence.
+    The resolved values are kept in a table with one entry per type and seen channel, which is
+    rebuilt when a value changes.
+    """
+
+    __remove_cooldowns: {(int, GameKey): Cooldown} = dict()
+    __guess_cooldowns: {(int, GameKey): Cooldown} = dict()
+    __start_cooldowns: {(int, GameKey): Cooldown} = dict()
+    __state_cooldowns: {(int, GameKey): Cooldown} = dict()
+    cooldown_values: {(CooldownType, Scope, int): int} = dict()
 
-    __remove_cooldowns: {(int, int): Cooldown} = dict()
-    __guess_cooldowns: {(int, int): Cooldown} = dict()
-    __start_cooldowns: {(int, int): Cooldown} = dict()
-    __state_cooldowns: {(int, int): Cooldown} = dict()
-    cooldown_values: {(CooldownType, int): int} = dict()
+    __persister: Persister
+    __table: {(CooldownType, int): int}
+    __channel_guilds: {int: int}
 
     @classmethod
-    def from_json(cls, data: [dict]):
+    def from_json(cls, data: dict):
         """Creates a instance of Cooldowns from json data"""
         logging.debug("Loaded cooldowns: %s", data)
+        # Older files only contain the list of cooldown values
+        values = data if isinstance(data, list) else data['values']
         cooldowns = dict()
-        for cooldown in data:
-            cd_type, channel, value = cooldown['type'], cooldown['channel'], cooldown['value']
-            cooldowns[(CooldownType(cd_type), channel)] = value
-        return cls(cooldown_values=cooldowns)
+        for cooldown in values:
+            # Older files only contain channel values
+            scope = Scope(cooldown.get('scope', Scope.CHANNEL))
+            scope_id = cooldown['id'] if 'id' in cooldown else cooldown['channel']
+            cooldowns[(CooldownType(cooldown['type']), scope, scope_id)] = cooldown['value']
+        instance = cls(cooldown_values=cooldowns)
+        for cooldown in [] if isinstance(data, list) else data['active']:
+            key = (CooldownType(cooldown['type']), cooldown['author'],
+                   (cooldown['channel'], cooldown['thread']))
+            instance.__store(key, Cooldown.from_json(cooldown))
+        return instance
 
     @classmethod
     def load(cls):
@@ -84,10 +144,13 @@ class Cooldowns:
             logging.debug("No Cooldowns file found to load (%s)", err)
             return cls()
 
-    def __init__(self, cooldown_values: {(CooldownType, int): int} = None):
+    def __init__(self, cooldown_values: {(CooldownType, Scope, int): int} = None):
         self.cooldown_values = cooldown_values if cooldown_values else {}
+        self.__table = {}
+        self.__channel_guilds = {}
+        self.__persister = Persister(COOLDOWNS_FILE, lambda: json.dumps(self, cls=CooldownsEncoder))
 
-    def __getitem__(self, item: (CooldownType, int, int)) -> Cooldown:
+    def __getitem__(self, item: (CooldownType, int, GameKey)) -> Cooldown:
         cd_type, author, channel = item
         if cd_type == CooldownType.START:
             return self.__start_cooldowns.get((author, channel))
@@ -97,7 +160,7 @@ class Cooldowns:
             return self.__guess_cooldowns.get((author, channel))
         return self.__state_cooldowns.get((author, channel))
 
-    def __contains__(self, item: (CooldownType, int, int)) -> bool:
+    def __contains__(self, item: (CooldownType, int, GameKey)) -> bool:
         cd_type, author, channel = item
         if cd_type == CooldownType.START:
             return self.__start_cooldowns.__contains__((author, channel))
@@ -107,7 +170,7 @@ class Cooldowns:
             return self.__guess_cooldowns.__contains__((author, channel))
         return self.__state_cooldowns.__contains__((author, channel))
 
-    def __delitem__(self, key: (CooldownType, int, int)):
+    def __delitem__(self, key: (CooldownType, int, GameKey)):
         cd_type, author, channel = key
         if cd_type == CooldownType.START:
             cds = self.__start_cooldowns
@@ -122,45 +185,75 @@ class Cooldowns:
         cds.pop((author, channel), None)
 
     def __save(self):
-        serialized = json.dumps(self, cls=CooldownsEncoder)
-        try:
-            os.makedirs(CONFIG_DIR, exist_ok=True)
-            states_file = open(COOLDOWNS_FILE, "w")
-            states_file.write(serialized)
-        except OSError as err:
-            logging.error("Couldn't write cooldowns file: %s", err)
-            sys.exit(1)
-
-    def __get_cooldown_seconds_for(self, key: (CooldownType, int)) -> int:
-        seconds = self.cooldown_values.get(key)
-        if seconds or seconds == 0:
-            return seconds
-        cd_type, _ = key
-        if cd_type == CooldownType.START:
-            return DEFAULT_START_COOLDOWN
-        if cd_type == CooldownType.REMOVE:
-            return DEFAULT_RM_COOLDOWN
-        if cd_type == CooldownType.GUESS:
-            return DEFAULT_GUESS_COOLDOWN
-        return DEFAULT_STATE_COOLDOWN
-
-    def set_cooldown(self, key: (CooldownType, int), value: int):
-        """Sets a cooldown value for a type and channel"""
-        self.cooldown_values[key] = value if value else 0
+        self.__persister.save()
+
+    async def flush(self) -> bool:
+        """Persists the cooldown values and all active cooldowns, retrying failed writes.
+        Returns if it was successful."""
+        return await self.__persister.flush()
+
+    def policy(self, cd_type: CooldownType, guild_id: int, channel_id: int) -> {Scope: int}:
+        """Returns the values configured for a channel and its guild by scope"""
+        return {
+            Scope.GLOBAL: self.cooldown_values.get((cd_type, Scope.GLOBAL, 0)),
+            Scope.GUILD: self.cooldown_values.get((cd_type, Scope.GUILD, guild_id)),
+            Scope.CHANNEL: self.cooldown_values.get((cd_type, Scope.CHANNEL, channel_id)),
+        }
+
+    def __resolve(self, cd_type: CooldownType, guild_id: int, channel_id: int) -> int:
+        policy = self.policy(cd_type, guild_id, channel_id)
+        for scope in (Scope.CHANNEL, Scope.GUILD, Scope.GLOBAL):
+            if policy[scope] is not None:
+                return policy[scope]
+        return DEFAULTS[cd_type]
+
+    def __compile(self):
+        self.__table = {
+            (cd_type, channel_id): self.__resolve(cd_type, guild_id, channel_id)
+            for channel_id, guild_id in self.__channel_guilds.items()
+            for cd_type in CooldownType
+        }
+
+    def seconds_for(self, cd_type: CooldownType, guild_id: int, channel_id: int) -> int:
+        """Returns the cooldown seconds of the type in a channel of a guild (0 if it's no guild
+        channel). Channels are added to the lookup table the first time they're seen."""
+        seconds = self.__table.get((cd_type, channel_id))
+        if seconds is None:
+            self.__channel_guilds[channel_id] = guild_id
+            for each_type in CooldownType:
+                self.__table[(each_type, channel_id)] = self.__resolve(
+                    each_type, guild_id, channel_id)
+            seconds = self.__table[(cd_type, channel_id)]
+        return seconds
+
+    def set_cooldowns(self, cd_type: CooldownType, scope: Scope, scope_ids: [int], value: int):
+        """Sets the value for a type in all given guilds or channels (depending on the scope)
+        with a single write. The value is removed instead if it's None."""
+        for scope_id in scope_ids:
+            if value is None:
+                self.cooldown_values.pop((cd_type, scope, scope_id), None)
+            else:
+                self.cooldown_values[(cd_type, scope, scope_id)] = value
+        self.__compile()
         self.__save()
 
-    def get_cooldown(self, key: (CooldownType, int)) -> Cooldown:
-        """Gets a cooldown value for a type and channel"""
-        return Cooldown(self.cooldown_values.get(
-            key,
-            self.__get_cooldown_seconds_for(key)))
+    def get_cooldown(self, key: (CooldownType, int, int)) -> Cooldown:
+        """Gets a cooldown for a type, guild and channel"""
+        return Cooldown(self.seconds_for(*key))
 
-    def add_for(self, key: (CooldownType, int, int), cooldown: Cooldown = None):
-        """Creates a cooldown for the given key (type, author_id, channel_id) and
-        sets a default Cooldown based on the type and configured cooldown value."""
-        cd_type, author, channel = key
+    def add_for(self, key: (CooldownType, int, GameKey), guild_id: int, cooldown: Cooldown = None):
+        """Creates a cooldown for the given key (type, author_id, game_key) and
+        sets a default Cooldown based on the type and the value configured for the channel.
+
+        Active cooldowns are only persisted on flush."""
+        cd_type, _, channel = key
+        channel_id, _ = channel
         cooldown = cooldown if cooldown else Cooldown(
-            self.__get_cooldown_seconds_for((cd_type, channel)))
+            self.seconds_for(cd_type, guild_id, channel_id))
+        self.__store(key, cooldown)
+
+    def __store(self, key: (CooldownType, int, GameKey), cooldown: Cooldown):
+        cd_type, author, channel = key
         if cd_type == CooldownType.START:
             self.__start_cooldowns[(author, channel)] = cooldown
         elif cd_type == CooldownType.REMOVE:
@@ -171,7 +264,18 @@ class Cooldowns:
             self.__state_cooldowns[(author, channel)] = cooldown
         else:
             raise RuntimeError(f"Unsupported CooldownType: {cd_type}")
-        self.__save()
+
+    def active(self) -> [((CooldownType, int, GameKey), Cooldown)]:
+        """Returns all cooldowns which are not expired yet"""
+        result = []
+        for cd_type, cds in ((CooldownType.START, self.__start_cooldowns),
+                             (CooldownType.REMOVE, self.__remove_cooldowns),
+                             (CooldownType.GUESS, self.__guess_cooldowns),
+                             (CooldownType.STATE, self.__state_cooldowns)):
+            for (author, channel), cooldown in cds.items():
+                if not cooldown.expired():
+                    result.append(((cd_type, author, channel), cooldown))
+        return result
 
     def clear(self, cd_type: CooldownType):
         """Clears a type of cooldown"""
@@ -189,9 +293,14 @@ class CooldownsEncoder(json.JSONEncoder):
     """Implements serializing cooldowns to json"""
     def default(self, o: Any) -> Any:
         if isinstance(o, Cooldowns):
-            cooldowns = []
+            values = []
             for key, value in o.cooldown_values.items():
-                cd_type, channel = key
-                cooldowns.append({'type': int(cd_type), 'channel': channel, 'value': value})
-            return cooldowns
+                cd_type, scope, scope_id = key
+                values.append({'type': int(cd_type), 'scope': int(scope), 'id': scope_id,
+                               'value': value})
+            active = []
+            for (cd_type, author, (channel, thread)), cooldown in o.active():
+                active.append({'type': int(cd_type), 'author': author,
+                               'channel': channel, 'thread': thread, **cooldown.to_json()})
+            return {'values': values, 'active': active}
         return super().default(o)
@@ -0,0 +1,47 @@
+"""Applying guesses to games, shared by the `!guess` command and the guess menus"""
+
+import discord
+
+from cooldowns import Cooldown, Cooldowns, CooldownType
+from states import States, State, Running, Solved, Failed, GameKey
+
+
+def active_cooldown(cooldowns: Cooldowns, cooldown_id: (CooldownType, int, GameKey)) -> Cooldown:
+    """Returns the cooldown if it isn't expired yet, expired cooldowns are removed"""
+    if cooldown_id in cooldowns:
+        cooldown = cooldowns[cooldown_id]
+        if not cooldown.expired():
+            return cooldown
+        del cooldowns[cooldown_id]
+    return None
+
+
+def apply_guess(states: States, cooldowns: Cooldowns, key: GameKey, old_state: Running,
+                guess: str, guesser: discord.Member, guild_id: int) -> State:
+    """Applies the guess to the game and updates states and cooldowns. Returns the new state.
+    The game post has to be updated to show `old_state` afterwards."""
+    author_id = guesser.id
+    guess_cooldown_id = (CooldownType.GUESS, author_id, key)
+    remove_cooldown_id = (CooldownType.REMOVE, author_id, key)
+    start_cooldown_id = (CooldownType.START, author_id, key)
+
+    new_state = old_state.guess(guess, guesser)
+    states[key] = new_state
+
+    if isinstance(new_state, (Solved, Failed)):
+        # Unveil all remaining characters in old state if solved
+        if isinstance(new_state, Solved):
+            old_state.unveil()
+
+        # Also add Cooldown for users which started the game so others can start a game
+        cooldowns.add_for(start_cooldown_id, guild_id)
+
+        del states[key]
+        # Cooldown on remove should be cleared to save space
+        del cooldowns[remove_cooldown_id]
+    if isinstance(new_state, Running):
+        if new_state.guessing_started() and (remove_cooldown_id not in cooldowns):
+            cooldowns.add_for(remove_cooldown_id, guild_id)
+    cooldowns.clear(CooldownType.GUESS)
+    cooldowns.add_for(guess_cooldown_id, guild_id)
+    return new_state
@@ -0,0 +1,96 @@
+"""Hand-off between a running bot process and its replacement"""
+
+import logging
+import os
+import signal
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+from settings import LOCK_FILE, PID_FILE
+
+POLL_SECONDS = 0.5
+
+# Held open (and locked) for the lifetime of the bot process, the OS releases the lock on exit
+_lock_file = None
+
+
+def _try_lock(lock_file) -> bool:
+    """Locks the file exclusively without waiting. Returns if the lock was acquired."""
+    try:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def _read_pid() -> int:
+    try:
+        with open(PID_FILE, "r") as pid_file:
+            return int(pid_file.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def take_over(timeout: float):
+    """Asks a running bot process to shut down and waits till it flushed its state and exited.
+    Has to be called before loading the persisted states and cooldowns.
+
+    The running bot holds a lock on `LOCK_FILE`, so the pid in `PID_FILE` is only signaled
+    while it's certainly a bot process. Raises a RuntimeError if the running bot can't be
+    detected or stopped on this platform, or doesn't exit within `timeout` seconds, instead of
+    running two bots on the same data.
+    """
+    global _lock_file
+    if not fcntl and not msvcrt:
+        raise RuntimeError("Locking files isn't supported on this platform, "
+                           "so a running bot process can't be detected")
+    os.makedirs(os.path.dirname(LOCK_FILE), exist_ok=True)
+    lock_file = open(LOCK_FILE, "a+")
+    if not _try_lock(lock_file):
+        pid = _read_pid()
+        if pid is None or os.name == "nt":
+            # Windows can only kill processes, which would lose the state of the running bot
+            lock_file.close()
+            raise RuntimeError(f"Bot process {pid or '(unknown pid)'} is still running, "
+                               f"stop it before starting a new one")
+        logging.info("Taking over from running bot process %d", pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError as err:
+            logging.warning("Couldn't signal bot process %d: %s", pid, err)
+        deadline = time.monotonic() + timeout
+        while not _try_lock(lock_file):
+            if time.monotonic() >= deadline:
+                lock_file.close()
+                raise RuntimeError(f"Bot process {pid} didn't exit within {timeout}s")
+            time.sleep(POLL_SECONDS)
+    _lock_file = lock_file
+
+    with open(PID_FILE, "w") as pid_file:
+        pid_file.write(str(os.getpid()))
+
+
+def release():
+    """Removes the pid file and releases the lock if they still belong to this process"""
+    global _lock_file
+    if not _lock_file:
+        return
+    if _read_pid() == os.getpid():
+        try:
+            os.remove(PID_FILE)
+        except OSError:
+            pass
+    _lock_file.close()
+    _lock_file = None
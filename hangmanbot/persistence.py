@@ -0,0 +1,90 @@
+"""Persisting serialized data to files"""
+
+import asyncio
+import logging
+import os
+from typing import Callable
+
+# Number of failed writes in a row after which failures are logged as critical
+ALERT_AFTER_FAILURES = 3
+RETRY_DELAY_SECONDS = 5
+MAX_RETRY_DELAY_SECONDS = 300
+
+
+def write_atomic(path: str, serialized: str, durable: bool = False):
+    """Writes the file so readers either see the previous or the complete new content.
+
+    A crash of the bot can't leave a partial file behind either way. Only `durable` writes
+    also survive a crash of the system, because they wait (fsync) until the content reached
+    the disk, which can take several milliseconds.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        file.write(serialized)
+        if durable:
+            file.flush()
+            os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+class Persister:
+    """Writes data to a file and retries failed writes in the background.
+
+    Failed writes never stop the bot. The data stays dirty and is written again with an
+    increasing delay, by the next save or on flush. Saves run in the event loop on every
+    change, so only `flush` waits for the data to reach the disk.
+
+    Attributes:
+        dirty (bool): If the latest data wasn't written successfully yet.
+        failures (int): Number of failed writes in a row.
+
+    """
+    dirty: bool
+    failures: int
+    __path: str
+    __serialize: Callable[[], str]
+    __retry: asyncio.TimerHandle
+
+    def __init__(self, path: str, serialize: Callable[[], str]):
+        self.__path = path
+        self.__serialize = serialize
+        self.__retry = None
+        self.dirty = False
+        self.failures = 0
+
+    def save(self, durable: bool = False) -> bool:
+        """Writes the current data. Returns if writing was successful."""
+        if self.__retry:
+            self.__retry.cancel()
+            self.__retry = None
+        try:
+            write_atomic(self.__path, self.__serialize(), durable=durable)
+        except OSError as err:
+            self.dirty = True
+            self.failures += 1
+            log = logging.critical if self.failures >= ALERT_AFTER_FAILURES else logging.error
+            log("Couldn't write %s (%d failures in a row): %s", self.__path, self.failures, err)
+            self.__schedule_retry()
+            return False
+        self.dirty = False
+        self.failures = 0
+        return True
+
+    def __schedule_retry(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not running in the bot (yet), the next save or flush will retry
+            return
+        delay = min(RETRY_DELAY_SECONDS * 2 ** (self.failures - 1), MAX_RETRY_DELAY_SECONDS)
+        self.__retry = loop.call_later(delay, self.save)
+
+    async def flush(self, attempts: int = 3) -> bool:
+        """Writes the current data, waiting until it succeeded or all attempts failed"""
+        for attempt in range(attempts):
+            if attempt:
+                await asyncio.sleep(RETRY_DELAY_SECONDS)
+            if self.save(durable=True):
+                return True
+        return False
@@ -0,0 +1,119 @@
+"""Time limited profiling of the running bot"""
+
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import tracemalloc
+from datetime import datetime
+
+from settings import PROFILES_DIR
+
+MAX_SECONDS = 300
+TOP = 25
+TRACEBACK_FRAMES = 10
+
+
+class Profiler:
+    """Captures cpu profiles and memory snapshots of the running bot into `PROFILES_DIR`.
+
+    Only one capture runs at a time. Every capture writes the raw data (`.prof` readable by
+    pstats/snakeviz, `.snapshot` readable by tracemalloc) and a `.txt` summary.
+    """
+    running: bool
+
+    def __init__(self):
+        self.running = False
+
+    @staticmethod
+    def __base_path(kind: str) -> str:
+        os.makedirs(PROFILES_DIR, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        return os.path.join(PROFILES_DIR, f"{kind}-{timestamp}")
+
+    async def profile_cpu(self, seconds: int) -> (str, str):
+        """Profiles all code running in the event loop for the given seconds (1 to
+        `MAX_SECONDS`). Returns the path of the summary and the summary itself."""
+        self.__start(seconds)
+        try:
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profile.disable()
+        finally:
+            self.running = False
+        # Writing and sorting the stats takes a while for large profiles
+        return await asyncio.get_running_loop().run_in_executor(None, self.__summarize_cpu,
+                                                                profile)
+
+    async def profile_memory(self, seconds: int) -> (str, str):
+        """Traces allocations for the given seconds (1 to `MAX_SECONDS`) and takes a snapshot
+        of the traced memory. Only allocations made during the capture are traced, unless
+        tracing was already started (e.g. with PYTHONTRACEMALLOC). Returns the path of the
+        summary and the summary itself."""
+        self.__start(seconds)
+        started = not tracemalloc.is_tracing()
+        try:
+            if started:
+                tracemalloc.start(TRACEBACK_FRAMES)
+            await asyncio.sleep(seconds)
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if started:
+                tracemalloc.stop()
+            self.running = False
+        # Grouping the traces of a snapshot takes seconds with many allocations
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.__summarize_memory, snapshot, current, peak)
+
+    def __start(self, seconds: int):
+        if not 1 <= seconds <= MAX_SECONDS:
+            raise ValueError(f"Captures take 1 to {MAX_SECONDS} seconds")
+        if self.running:
+            raise RuntimeError("Another capture is still running")
+        self.running = True
+
+    @classmethod
+    def __summarize_cpu(cls, profile: cProfile.Profile) -> (str, str):
+        base_path = cls.__base_path("cpu")
+        profile.dump_stats(f"{base_path}.prof")
+        stream = io.StringIO()
+        stats = pstats.Stats(profile, stream=stream).strip_dirs()
+        stream.write(f"Top {TOP} functions by cumulative time\n")
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP)
+        stream.write(f"Top {TOP} functions by own time\n")
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(TOP)
+        return cls.__write_summary(base_path, stream.getvalue())
+
+    @classmethod
+    def __summarize_memory(cls, snapshot: tracemalloc.Snapshot, current: int,
+                           peak: int) -> (str, str):
+        base_path = cls.__base_path("memory")
+        snapshot.dump(f"{base_path}.snapshot")
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ])
+        lines = [f"Traced memory: {current / 1024:.1f} KiB (peak {peak / 1024:.1f} KiB)",
+                 f"Top {TOP} allocation sites"]
+        for stat in snapshot.statistics("lineno")[:TOP]:
+            lines.append(f"{stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  "
+                         f"{stat.traceback[0]}")
+        lines.append("Largest allocation site")
+        largest = snapshot.statistics("traceback")[:1]
+        for stat in largest:
+            lines.extend(stat.traceback.format())
+        return cls.__write_summary(base_path, "\n".join(lines) + "\n")
+
+    @staticmethod
+    def __write_summary(base_path: str, summary: str) -> (str, str):
+        path = f"{base_path}.txt"
+        with open(path, "w") as summary_file:
+            summary_file.write(summary)
+        logging.info("Wrote profile %s", path)
+        return path, summary
@@ -0,0 +1,137 @@
+"""Bounded per game command queues"""
+
+from __future__ import annotations
+import asyncio
+import logging
+from enum import Enum
+from functools import partial
+from typing import Awaitable, Callable
+
+# Same as states.GameKey, which can't be imported without discord
+GameKey = (int, int)
+
+
+class ShedReason(Enum):
+    """Reason why a command was dropped instead of processed"""
+
+    DUPLICATE = "duplicate"
+    FINISHED = "finished"
+    FULL = "full"
+
+
+class Command:
+    """A queued command.
+
+    Attributes:
+        name (str): Normalized command (e.g. the guess), used to drop duplicates.
+        handler (Callable[[], Awaitable]): Processes the command.
+        valid (Callable[[], bool]): Returns if the game the command targets is still running.
+        on_shed (Callable[[ShedReason], Awaitable]): Called if the command is shed after it was
+            queued, e.g. to answer an interaction. `submit` returns the reason instead.
+
+    """
+    name: str
+    handler: Callable[[], Awaitable]
+    valid: Callable[[], bool]
+    on_shed: Callable[[ShedReason], Awaitable]
+
+    def __init__(self, name: str, handler: Callable[[], Awaitable], valid: Callable[[], bool],
+                 on_shed: Callable[[ShedReason], Awaitable] = None):
+        self.name = name
+        self.handler = handler
+        self.valid = valid
+        self.on_shed = on_shed
+
+
+class CommandQueues:
+    """Processes commands of each game one after another with a bounded queue per game.
+
+    Commands are shed instead of queued if an equal command is already waiting, the targeted
+    game already finished or the queue of the game is full. A worker only exists as long as
+    the queue of its game isn't empty.
+    """
+    depth: int
+    processed: int
+    shed: {ShedReason: int}
+    __queues: {GameKey: asyncio.Queue}
+    __pending: {GameKey: {str}}
+    __workers: {GameKey: asyncio.Future}
+
+    def __init__(self, depth: int):
+        self.depth = depth
+        self.processed = 0
+        self.shed = {reason: 0 for reason in ShedReason}
+        self.__queues = {}
+        self.__pending = {}
+        self.__workers = {}
+
+    def __shed(self, key: GameKey, command: Command, reason: ShedReason) -> ShedReason:
+        self.shed[reason] += 1
+        logging.debug("Shed command '%s' for game %s: %s", command.name, key, reason.value)
+        return reason
+
+    def submit(self, key: GameKey, command: Command) -> ShedReason:
+        """Queues the command for the game. Returns the reason if it was shed, else None."""
+        if not command.valid():
+            return self.__shed(key, command, ShedReason.FINISHED)
+        pending = self.__pending.setdefault(key, set())
+        if command.name in pending:
+            return self.__shed(key, command, ShedReason.DUPLICATE)
+
+        queue = self.__queues.get(key)
+        if queue is None:
+            queue = self.__queues[key] = asyncio.Queue(self.depth)
+            self.__workers[key] = asyncio.ensure_future(self.__work(key, queue))
+        try:
+            queue.put_nowait(command)
+        except asyncio.QueueFull:
+            return self.__shed(key, command, ShedReason.FULL)
+        pending.add(command.name)
+        return None
+
+    async def __work(self, key: GameKey, queue: asyncio.Queue):
+        while not queue.empty():
+            command: Command = queue.get_nowait()
+            self.__pending[key].discard(command.name)
+            # Game might have finished while the command was waiting
+            if not command.valid():
+                self.__shed(key, command, ShedReason.FINISHED)
+                if command.on_shed:
+                    await self.__run(key, command, partial(command.on_shed, ShedReason.FINISHED))
+                continue
+            await self.__run(key, command, command.handler)
+            self.processed += 1
+        del self.__queues[key]
+        del self.__pending[key]
+        del self.__workers[key]
+
+    @staticmethod
+    async def __run(key: GameKey, command: Command, func: Callable[[], Awaitable]):
+        try:
+            await func()
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("Error processing command '%s' for game %s", command.name, key)
+
+    async def drain(self, timeout: float) -> int:
+        """Waits until all queued commands are processed or the timeout passed.
+        Returns the number of commands which are still queued."""
+        if self.__workers:
+            await asyncio.wait(list(self.__workers.values()), timeout=timeout)
+        return sum(self.depths().values())
+
+    def depths(self) -> {GameKey: int}:
+        """Returns the number of waiting commands of all games with a non empty queue"""
+        return {key: queue.qsize() for key, queue in self.__queues.items()}
+
+    def metrics(self) -> {str: int}:
+        """Returns the current queue depths and processed and shed commands"""
+        depths = self.depths()
+        metrics = {
+            'queues': len(depths),
+            'queued': sum(depths.values()),
+            'max_depth': max(depths.values(), default=0),
+            'processed': self.processed,
+        }
+        for reason, count in self.shed.items():
+            metrics[f"shed_{reason.value}"] = count
+        return metrics
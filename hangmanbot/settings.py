@@ -9,9 +9,27 @@ load_dotenv()
 APP_NAME = "HangmanBot"
 APP_AUTHOR = "Mo Blaa"
 DISCORD_TOKEN = os.getenv("TOKEN")
-CONFIG_DIR = user_data_dir(APP_NAME, APP_AUTHOR)
+CONFIG_DIR = os.getenv("DATA_DIR") or user_data_dir(APP_NAME, APP_AUTHOR)
 STATES_FILE = os.path.join(CONFIG_DIR, ".states.json")
 COOLDOWNS_FILE = os.path.join(CONFIG_DIR, ".cooldowns.json")
+WORDLISTS_DIR = os.path.join(CONFIG_DIR, "wordlists")
+WORDLIST_INDEX_FILE = os.path.join(CONFIG_DIR, ".wordlists.idx")
+PROFILES_DIR = os.path.join(CONFIG_DIR, "profiles")
+LAG_REPORTS_FILE = os.path.join(CONFIG_DIR, "lag_reports.log")
+PID_FILE = os.path.join(CONFIG_DIR, ".pid")
+LOCK_FILE = os.path.join(CONFIG_DIR, ".lock")
+BUNDLED_WORDLISTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "wordlists")
+# Maximum number of waiting guesses per game, further guesses are dropped
+COMMAND_QUEUE_DEPTH = int(os.getenv("COMMAND_QUEUE_DEPTH", "10"))
+# Seconds to wait for queued guesses on shutdown and for a running bot to exit on takeover
+SHUTDOWN_TIMEOUT = int(os.getenv("SHUTDOWN_TIMEOUT", "30"))
+# Attach menus to guess letters to game posts
+GUESS_COMPONENTS = os.getenv("GUESS_COMPONENTS", "").lower() in {"1", "true", "yes"}
+# Blocking the event loop longer than this is reported with the blocking stack
+LAG_THRESHOLD_MS = int(os.getenv("LAG_THRESHOLD_MS", "250"))
 
 if not DISCORD_TOKEN:
     raise RuntimeError("TOKEN EnvVar required (or .env)")
+# A queue of depth 0 or less would be unbounded
+if COMMAND_QUEUE_DEPTH < 1:
+    raise RuntimeError("COMMAND_QUEUE_DEPTH has to be at least 1")
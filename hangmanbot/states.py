@@ -3,13 +3,23 @@
 from __future__ import annotations
 import logging
 import json
-import os
-import sys
 from typing import Any
 
 import discord
-from settings import STATES_FILE, CONFIG_DIR
+from settings import STATES_FILE
 from ascii import MAX_GUESSES, HANGMANS
+from persistence import Persister
+
+# Identifies a game by (channel_id, thread_id). Games in the channel itself have thread_id 0.
+GameKey = (int, int)
+
+
+def game_key(channel: discord.abc.Messageable) -> GameKey:
+    """Returns the key of the game hosted in the given channel or thread"""
+    parent_id = getattr(channel, "parent_id", None)
+    if parent_id is not None:
+        return parent_id, channel.id
+    return channel.id, 0
 
 
 class State:
@@ -209,17 +219,19 @@ class Failed(State):
 
 
 class States:
-    """Manages states of multiple channels and persists them on change"""
-    states: {int: State} = {}
+    """Manages states of multiple games and persists them on change"""
+    states: {GameKey: State} = {}
+    __persister: Persister
 
-    def __init__(self, states: {int: State}):
+    def __init__(self, states: {GameKey: State}):
         self.states = states
+        self.__persister = Persister(STATES_FILE, lambda: json.dumps(self, cls=StatesEncoder))
 
-    def __getitem__(self, channel_id: int):
-        return self.states[channel_id]
+    def __getitem__(self, key: GameKey):
+        return self.states[key]
 
-    def __setitem__(self, channel_id: int, state: State):
-        self.states[channel_id] = state
+    def __setitem__(self, key: GameKey, state: State):
+        self.states[key] = state
         self.__save()
 
     def __delitem__(self, key):
@@ -234,21 +246,20 @@ class States:
 
     def __save(self):
         """Persists the current states of hangman games"""
-        serialized = json.dumps(self.states, cls=StatesEncoder)
-        try:
-            os.makedirs(CONFIG_DIR, exist_ok=True)
-            states_file = open(STATES_FILE, "w")
-            states_file.write(serialized)
-        except OSError as err:
-            logging.error("Couldn't write states file: %s", err)
-            sys.exit(1)
+        self.__persister.save()
+
+    async def flush(self) -> bool:
+        """Persists the current states, retrying failed writes. Returns if it was successful."""
+        return await self.__persister.flush()
 
     @classmethod
     def from_json(cls, data: dict) -> States:
         """Parses this class from json deserialized data"""
         states = {}
         for key, val in data.items():
-            key: int = int(key)
+            # Keys are "<channel_id>:<thread_id>", older files only contain the channel_id
+            channel_id, _, thread_id = key.partition(":")
+            key: GameKey = (int(channel_id), int(thread_id or 0))
             if 'Solved' in val:
                 states[key] = Solved.from_json(val['Solved'])
             elif 'Failed' in val:
@@ -303,8 +314,8 @@ class StatesEncoder(json.JSONEncoder):
                 }
             }
         if isinstance(o, States):
-            states: {int: State} = {}
-            for channel, state in o.states:
-                states[channel] = self.default(state)
+            states: {str: dict} = {}
+            for (channel_id, thread_id), state in o.states.items():
+                states[f"{channel_id}:{thread_id}"] = self.default(state)
             return states
         return super().default(o)
@@ -0,0 +1,163 @@
+"""Watchdog measuring the scheduling delay (lag) of the event loop"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Callable
+
+# Upper bounds of the lag histogram buckets in milliseconds
+LAG_BUCKETS_MS = (1, 5, 10, 50, 100, 250, 500, 1000, 5000, float("inf"))
+MAX_REPORTS = 50
+
+
+class LagReport:
+    """Report of the event loop being blocked longer than the threshold.
+
+    Attributes:
+        started (datetime): When the loop was last seen responsive.
+        lag (float): Seconds the loop was blocked, updated once it's responsive again.
+        handler (str): Command handler which was running while the loop was blocked.
+        stack (str): Stack of the event loop thread while it was blocked.
+
+    """
+    started: datetime
+    lag: float
+    handler: str
+    stack: str
+
+    def __init__(self, started: datetime, lag: float, handler: str, stack: str):
+        self.started = started
+        self.lag = lag
+        self.handler = handler
+        self.stack = stack
+
+    def __str__(self):
+        return f"Loop blocked for {self.lag * 1000:.0f}ms at {self.started:%H:%M:%S} " \
+               f"in {self.handler or 'unknown handler'}"
+
+
+class LoopWatchdog:
+    """Measures the lag of the event loop and reports what's blocking it.
+
+    A task in the loop wakes up every `interval` seconds and records how late it was woken up
+    in a histogram. A thread checks if the task stopped waking up for longer than `threshold`
+    seconds. If it did, the stack of the loop thread and the command handler in it are captured
+    while the loop is still blocked. The report is handed over to the task under a lock and
+    completed by the wake up which ended the blocking, with the lag measured by that wake up.
+
+    Attributes:
+        histogram ([int]): Number of wake ups per bucket of `LAG_BUCKETS_MS`.
+        reports (deque): The latest reports, newest last.
+
+    """
+    histogram: [int]
+    reports: deque
+    __interval: float
+    __threshold: float
+    __report_file: str
+    __handlers: {object: str}
+    __heartbeat: float
+    __loop_thread: int
+    __current: LagReport
+    __lock: threading.Lock
+
+    def __init__(self, interval: float, threshold: float, report_file: str = None):
+        self.histogram = [0] * len(LAG_BUCKETS_MS)
+        self.reports = deque(maxlen=MAX_REPORTS)
+        self.__interval = interval
+        self.__threshold = threshold
+        self.__report_file = report_file
+        self.__handlers = {}
+        self.__heartbeat = None
+        self.__loop_thread = None
+        self.__current = None
+        self.__lock = threading.Lock()
+
+    def register(self, handler: Callable, name: str):
+        """Registers a function so reports name it if it's blocking the loop"""
+        self.__handlers[handler.__code__] = name
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Starts measuring the lag of the loop, which has to run in the current thread"""
+        self.__loop_thread = threading.get_ident()
+        self.__heartbeat = time.monotonic()
+        loop.create_task(self.__tick())
+        threading.Thread(target=self.__watch, name="loop-watchdog", daemon=True).start()
+
+    async def __tick(self):
+        while True:
+            expected = time.monotonic() + self.__interval
+            await asyncio.sleep(self.__interval)
+            now = time.monotonic()
+            lag = max(now - expected, 0)
+            with self.__lock:
+                self.__heartbeat = now
+                report, self.__current = self.__current, None
+            for bucket, bound in enumerate(LAG_BUCKETS_MS):
+                if lag * 1000 <= bound:
+                    self.histogram[bucket] += 1
+                    break
+            if report:
+                # This wake up ended the blocking, so the report is complete
+                report.lag = lag
+                self.__finish(report)
+
+    def __watch(self):
+        while True:
+            time.sleep(self.__threshold / 2)
+            with self.__lock:
+                heartbeat, pending = self.__heartbeat, self.__current
+            blocked = time.monotonic() - heartbeat - self.__interval
+            if blocked < self.__threshold or pending:
+                continue
+            # pylint: disable=protected-access
+            frame = sys._current_frames().get(self.__loop_thread)
+            if frame is None:
+                return
+            handler = None
+            current = frame
+            while current and not handler:
+                handler = self.__handlers.get(current.f_code)
+                current = current.f_back
+            stack = "".join(traceback.format_stack(frame))
+            started = datetime.now().timestamp() - blocked
+            with self.__lock:
+                if self.__heartbeat != heartbeat:
+                    # The loop woke up while the stack was captured, which might not show
+                    # the blocking code anymore
+                    continue
+                self.__current = LagReport(datetime.fromtimestamp(started), blocked, handler,
+                                           stack)
+            logging.warning("Event loop blocked for more than %.0fms in %s", blocked * 1000,
+                            handler or "unknown handler")
+
+    def __finish(self, report: LagReport):
+        self.reports.append(report)
+        logging.warning("%s", report)
+        if self.__report_file:
+            # Writing the report in the loop would block it again
+            asyncio.get_running_loop().run_in_executor(None, self.__write, report)
+
+    def __write(self, report: LagReport):
+        try:
+            with open(self.__report_file, "a") as report_file:
+                report_file.write(f"{report}\n{report.stack}\n")
+        except OSError as err:
+            logging.error("Couldn't write lag report: %s", err)
+
+    def summary(self) -> str:
+        """Returns the histogram and the latest reports as text"""
+        lines = ["Loop lag histogram"]
+        lower = 0
+        for bound, count in zip(LAG_BUCKETS_MS, self.histogram):
+            label = f"> {lower}ms" if bound == float("inf") else f"{lower}-{bound}ms"
+            lines.append(f"{label:>14}: {count}")
+            lower = bound
+        lines.append(f"Latest blocking ({len(self.reports)} recorded)")
+        lines.extend(str(report) for report in list(self.reports)[-5:])
+        return "\n".join(lines)
@@ -0,0 +1,256 @@
+"""Indexed word lists used as phrase source for random games.
+
+Word lists are plain text files with one phrase per line. The file name (without extension)
+is the category of the contained phrases. All lists are compiled into a single binary index
+file which is memory mapped, so phrases are only decoded when they're drawn:
+
+    header      <4sHHI>   magic, version, reserved, bucket count
+    categories  <I>       category count, followed by <H> length prefixed utf-8 names and the
+                <QQ>      size and mtime (ns) of the list the category was compiled from
+    buckets     <IIIQ>    phrase length, category index, entry count, offset of entries
+    entries     <QI>      offset and size of a phrase in the data block
+    data                  utf-8 encoded phrases
+"""
+
+from __future__ import annotations
+import bisect
+import logging
+import mmap
+import os
+import random
+import shutil
+import struct
+import tempfile
+from array import array
+
+from settings import BUNDLED_WORDLISTS_DIR, WORDLISTS_DIR, WORDLIST_INDEX_FILE
+
+MAGIC = b"HMWL"
+VERSION = 2
+MIN_PHRASE_LENGTH = 3
+
+HEADER = struct.Struct("<4sHHI")
+CATEGORY_COUNT = struct.Struct("<I")
+CATEGORY_NAME = struct.Struct("<H")
+CATEGORY_SOURCE = struct.Struct("<QQ")
+BUCKET = struct.Struct("<IIIQ")
+ENTRY = struct.Struct("<QI")
+
+
+def sources(*directories: str) -> {str: str}:
+    """Returns the word list files of the given directories mapped by their category.
+    Lists of later directories replace lists of the same category in earlier ones."""
+    result = {}
+    for directory in directories:
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            category, ext = os.path.splitext(name)
+            if ext == ".txt":
+                result[category.lower()] = os.path.join(directory, name)
+    return result
+
+
+def signature(lists: {str: str}) -> {str: (int, int)}:
+    """Returns size and mtime of the given word lists (category -> file), which identify the
+    lists an index was compiled from. Lists which can't be read have size and mtime 0."""
+    result = {}
+    for category, path in lists.items():
+        try:
+            stat = os.stat(path)
+            result[category] = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            result[category] = (0, 0)
+    return result
+
+
+def build(lists: {str: str}, index_file: str, strict: {str} = frozenset()):
+    """Compiles the given word lists (category -> file) into an index file.
+
+    Phrases are streamed into a temporary data block while only their offsets are kept in
+    compact arrays, so lists much larger than the available memory can be compiled. Lines
+    which aren't valid utf-8 and lists which can't be read are skipped, unless their category is
+    in `strict`, which raises a ValueError/OSError instead. The index file is only replaced on
+    success.
+    """
+    categories = sorted(lists)
+    # Taken before reading, so lists changed while compiling are compiled again on the next load
+    stats = signature(lists)
+    buckets: {(int, int): (array, array)} = {}
+    with tempfile.TemporaryFile() as data:
+        position = 0
+        for category_index, category in enumerate(categories):
+            try:
+                source = open(lists[category], "rb")
+            except OSError as err:
+                if category in strict:
+                    raise
+                logging.error("Skipping word list %s: %s", lists[category], err)
+                continue
+            with source:
+                for line_number, line in enumerate(source, 1):
+                    try:
+                        phrase = line.decode("utf-8").strip()
+                    except UnicodeDecodeError as err:
+                        if category in strict:
+                            raise ValueError(f"Line {line_number} isn't valid utf-8") from err
+                        logging.warning("Skipping line %d of %s: %s", line_number,
+                                        lists[category], err)
+                        continue
+                    if len(phrase) < MIN_PHRASE_LENGTH:
+                        continue
+                    encoded = phrase.encode("utf-8")
+                    offsets, sizes = buckets.setdefault(
+                        (len(phrase), category_index), (array("Q"), array("I")))
+                    offsets.append(position)
+                    sizes.append(len(encoded))
+                    data.write(encoded)
+                    position += len(encoded)
+
+        names = [category.encode("utf-8") for category in categories]
+        data_offset = HEADER.size + CATEGORY_COUNT.size \
+            + sum(CATEGORY_NAME.size + len(name) + CATEGORY_SOURCE.size for name in names) \
+            + BUCKET.size * len(buckets)
+        entries_offset = data_offset
+        data_offset += sum(ENTRY.size * len(offsets) for offsets, _ in buckets.values())
+
+        os.makedirs(os.path.dirname(index_file), exist_ok=True)
+        # Unique per build, so concurrent builds can't write into the same file
+        tmp_fd, tmp_file = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(index_file))
+        try:
+            with open(tmp_fd, "wb") as index:
+                index.write(HEADER.pack(MAGIC, VERSION, 0, len(buckets)))
+                index.write(CATEGORY_COUNT.pack(len(names)))
+                for category, name in zip(categories, names):
+                    index.write(CATEGORY_NAME.pack(len(name)))
+                    index.write(name)
+                    index.write(CATEGORY_SOURCE.pack(*stats[category]))
+                for (length, category_index), (offsets, _) in sorted(buckets.items()):
+                    index.write(BUCKET.pack(length, category_index, len(offsets), entries_offset))
+                    entries_offset += ENTRY.size * len(offsets)
+                for _, (offsets, sizes) in sorted(buckets.items()):
+                    for offset, size in zip(offsets, sizes):
+                        index.write(ENTRY.pack(data_offset + offset, size))
+                data.seek(0)
+                shutil.copyfileobj(data, index)
+            os.replace(tmp_file, index_file)
+        except BaseException:
+            os.remove(tmp_file)
+            raise
+    logging.debug("Built word list index %s with %d buckets", index_file, len(buckets))
+
+
+class WordList:
+    """Memory mapped index of phrases bucketed by length and category.
+
+    Attributes:
+        categories ([str]): Categories contained in the index.
+        signature ({str: (int, int)}): Size and mtime of the lists compiled into the index,
+            see `signature`.
+
+    """
+    categories: [str]
+    signature: {str: (int, int)}
+    __mmap: mmap.mmap
+    __buckets: {(int, str): (int, int)}
+    __lengths: {int}
+    __candidates: {(int, str): ([int], [(int, int)])}
+
+    @classmethod
+    def load(cls) -> WordList:
+        """Opens the word list index and rebuilds it if word lists were added, changed, removed
+        or renamed since the last build"""
+        lists = sources(BUNDLED_WORDLISTS_DIR, WORDLISTS_DIR)
+        try:
+            wordlist = cls(WORDLIST_INDEX_FILE)
+        except (OSError, ValueError, struct.error) as err:
+            logging.info("Rebuilding word list index: %s", err)
+        else:
+            if wordlist.signature == signature(lists):
+                return wordlist
+            wordlist.close()
+        build(lists, WORDLIST_INDEX_FILE)
+        return cls(WORDLIST_INDEX_FILE)
+
+    @classmethod
+    def add(cls, category: str, path: str) -> WordList:
+        """Compiles the index with the word list file at `path` as `category` and moves the file
+        into `WORDLISTS_DIR` afterwards. Raises a ValueError and leaves the index and the word
+        lists untouched if the file isn't valid utf-8."""
+        lists = sources(BUNDLED_WORDLISTS_DIR, WORDLISTS_DIR)
+        lists[category] = path
+        build(lists, WORDLIST_INDEX_FILE, strict={category})
+        os.makedirs(WORDLISTS_DIR, exist_ok=True)
+        # Moving keeps size and mtime, so the index isn't considered outdated by `load`
+        os.replace(path, os.path.join(WORDLISTS_DIR, f"{category}.txt"))
+        return cls(WORDLIST_INDEX_FILE)
+
+    def __init__(self, index_file: str):
+        with open(index_file, "rb") as index:
+            self.__mmap = mmap.mmap(index.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, bucket_count = HEADER.unpack_from(self.__mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Unsupported word list index: {index_file}")
+
+        position = HEADER.size
+        category_count, = CATEGORY_COUNT.unpack_from(self.__mmap, position)
+        position += CATEGORY_COUNT.size
+        self.categories = []
+        self.signature = {}
+        for _ in range(category_count):
+            length, = CATEGORY_NAME.unpack_from(self.__mmap, position)
+            position += CATEGORY_NAME.size
+            category = self.__mmap[position:position + length].decode("utf-8")
+            position += length
+            self.categories.append(category)
+            self.signature[category] = CATEGORY_SOURCE.unpack_from(self.__mmap, position)
+            position += CATEGORY_SOURCE.size
+
+        self.__buckets = {}
+        for _ in range(bucket_count):
+            length, category_index, count, offset = BUCKET.unpack_from(self.__mmap, position)
+            position += BUCKET.size
+            self.__buckets[(length, self.categories[category_index])] = (count, offset)
+        self.__lengths = {length for length, _ in self.__buckets}
+        self.__candidates = {}
+
+    def __len__(self) -> int:
+        return sum(count for count, _ in self.__buckets.values())
+
+    def close(self):
+        """Unmaps the index file"""
+        self.__mmap.close()
+
+    def __candidates_for(self, length: int, category: str) -> ([int], [(int, int)]):
+        key = (length, category)
+        candidates = self.__candidates.get(key)
+        if candidates is None:
+            totals, buckets, total = [], [], 0
+            for (bucket_length, bucket_category), bucket in sorted(self.__buckets.items()):
+                if length is not None and bucket_length != length:
+                    continue
+                if category is not None and bucket_category != category:
+                    continue
+                total += bucket[0]
+                totals.append(total)
+                buckets.append(bucket)
+            candidates = self.__candidates[key] = (totals, buckets)
+        return candidates
+
+    def random(self, length: int = None, category: str = None) -> str:
+        """Draws a random phrase, optionally restricted to a phrase length and category.
+        Returns None if no phrase matches."""
+        category = category.lower() if category else None
+        # Only existing lengths and categories reach the cache, which keeps it bounded
+        if (length is not None and length not in self.__lengths) or \
+                (category is not None and category not in self.categories):
+            return None
+        totals, buckets = self.__candidates_for(length, category)
+        if not totals:
+            return None
+        choice = random.randrange(totals[-1])
+        bucket_index = bisect.bisect_right(totals, choice)
+        count, entries = buckets[bucket_index]
+        choice -= totals[bucket_index] - count
+        offset, size = ENTRY.unpack_from(self.__mmap, entries + choice * ENTRY.size)
+        return self.__mmap[offset:offset + size].decode("utf-8")